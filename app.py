@@ -1,4 +1,5 @@
 import streamlit as st
+from utils.auth import restore_session
 
 # Configure the page
 st.set_page_config(
@@ -22,6 +23,7 @@ st.title("Welcome to Financial Analytics Platform")
 
 if 'user' not in st.session_state:
     st.session_state.user = None
+restore_session()
 
 if st.session_state.user is None:
     st.write("Please login to access all features")
@@ -0,0 +1,69 @@
+# benchmarks/bench_process_financial_data.py
+# Compares the old row-by-row history table builder with the vectorized
+# utils.periods.process_financial_data.
+#
+#   python -m benchmarks.bench_process_financial_data [num_periods]
+import random
+import sys
+import timeit
+from datetime import date
+
+import pandas as pd
+
+from utils.periods import process_financial_data
+from utils.ratios import METRIC_KEYS
+
+
+def legacy_process_financial_data(data_list):
+    processed_data = []
+    for entry in data_list:
+        row = {
+            "Period": entry["duration"],
+            "Type": entry["duration_type"],
+            "Date Range": f"{entry['start_date']} to {entry['end_date']}",
+        }
+        for key, value in entry["data"].items():
+            display_key = " ".join(word.capitalize() for word in key.split("_"))
+            row[display_key] = value
+        processed_data.append(row)
+
+    df = pd.DataFrame(processed_data)
+    numeric_columns = df.select_dtypes(include=["float64", "int64"]).columns
+    for col in numeric_columns:
+        df[col] = df[col].apply(lambda x: "{:,.2f}".format(x))
+    return df
+
+
+def make_periods(num_periods):
+    rng = random.Random(0)
+    periods = []
+    for i in range(num_periods):
+        start = date(2000 + i // 12 % 100, i % 12 + 1, 1)
+        periods.append(
+            {
+                "duration": start.strftime("%b %Y"),
+                "duration_type": "Monthly",
+                "start_date": start.isoformat(),
+                "end_date": start.isoformat(),
+                "data": {key: rng.uniform(0, 1e7) for key in METRIC_KEYS},
+            }
+        )
+    return periods
+
+
+def main(num_periods=10000, repeat=5):
+    data_list = make_periods(num_periods)
+    legacy = min(
+        timeit.repeat(lambda: legacy_process_financial_data(data_list), number=1, repeat=repeat)
+    )
+    vectorized = min(
+        timeit.repeat(lambda: process_financial_data(data_list), number=1, repeat=repeat)
+    )
+    print(f"{num_periods} periods")
+    print(f"  legacy:     {legacy * 1000:8.1f} ms")
+    print(f"  vectorized: {vectorized * 1000:8.1f} ms")
+    print(f"  speedup:    {legacy / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
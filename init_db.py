@@ -1,27 +1,302 @@
 # init_db.py
-from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
-import bcrypt
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+import argparse
+from utils.db import check_health, get_db
+from utils.passwords import hash_password
+from utils.peers import rebuild_sketches
+from utils.users import user_query
+from utils.ratios import RATIOS_VERSION, compute_ratios, ratio_documents
 
-load_dotenv()
-
-client = MongoClient(os.getenv('MONGODB_URI'))
-db = client['financial_app']
+db = get_db()
 users = db.users
+financial_data = db.financial_data
+
+# Indexes backing the app's hot queries: login/registration lookups by
+# username and email, and a user's period history.
+INDEXES = {
+    "users": [
+        (
+            [("username", ASCENDING)],
+            {"name": "username_unique", "unique": True},
+        ),
+        (
+            [("email", ASCENDING)],
+            {
+                "name": "email_unique",
+                "unique": True,
+                # The admin account is created without an email
+                "partialFilterExpression": {"email": {"$type": "string"}},
+            },
+        ),
+        (
+            # Admin user search by email prefix and sort by email
+            # (utils/users.py); not partial, so it also covers users
+            # without an email
+            [("email", ASCENDING), ("username", ASCENDING)],
+            {"name": "email_username"},
+        ),
+        (
+            # Admin user table sorted by role
+            [("role", ASCENDING), ("username", ASCENDING)],
+            {"name": "role_username"},
+        ),
+    ],
+    "financial_data": [
+        (
+            # Period ranges and last-N lookups by integer key (yyyymm of the
+            # period start), utils/periods.find_periods
+            [("username", ASCENDING), ("duration_type", ASCENDING), ("period_index", ASCENDING)],
+            {"name": "username_duration_type_period_index"},
+        ),
+        (
+            # One document per period; writes upsert against this key
+            [("username", ASCENDING), ("duration_type", ASCENDING), ("duration", ASCENDING)],
+            {"name": "period_unique", "unique": True},
+        ),
+        (
+            # Keyset pagination of a user's history (utils/periods.py)
+            [("username", ASCENDING), ("start_date", DESCENDING), ("_id", DESCENDING)],
+            {"name": "username_start_date_id"},
+        ),
+    ],
+    "login_throttle": [
+        (
+            # Shared login rate-limit buckets (utils/throttle.py); an idle
+            # bucket is full again long before it expires
+            [("updated", ASCENDING)],
+            {"name": "updated_ttl", "expireAfterSeconds": 86400},
+        ),
+    ],
+    "session_revocations": [
+        (
+            # Revocations are dropped once the tokens they cover have expired
+            # (utils/sessions.py)
+            [("expires", ASCENDING)],
+            {"name": "expires_ttl", "expireAfterSeconds": 0},
+        ),
+    ],
+}
+
+# Indexes earlier versions created that no query uses any more;
+# create_indexes drops them
+OBSOLETE_INDEXES = {
+    # Replaced by username_duration_type_period_index
+    "financial_data": ["username_duration_type_start_date"],
+}
 
 def create_admin():
     if not users.find_one({"username": "admin"}):
         password = "admin123"
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        
         admin_user = {
             "username": "admin",
-            "password": hashed_password.decode('utf-8'),
+            "password": hash_password(password),
             "role": "admin"
         }
         users.insert_one(admin_user)
         print("Admin user created successfully!")
 
+def backfill_ratios(batch_size=1000, force=False):
+    # Recompute stored ratios for documents written before the current
+    # formula version (or all documents with force=True)
+    query = {} if force else {"ratios_version": {"$ne": RATIOS_VERSION}}
+    cursor = financial_data.find(query, {"data": 1}, batch_size=batch_size)
+
+    updated = 0
+    batch = []
+    for entry in cursor:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            updated += _write_ratios(batch)
+            batch = []
+    if batch:
+        updated += _write_ratios(batch)
+
+    if updated:
+        # Invalidate cached history pages (utils/periods.py)
+        users.update_many({}, {"$inc": {"data_version": 1}})
+        build_sketches(batch_size)
+    print(f"Recomputed ratios for {updated} documents (version {RATIOS_VERSION})")
+
+def build_sketches(batch_size=1000):
+    # Recount the peer percentile sketches (utils/peers.py) from scratch
+    count = rebuild_sketches(financial_data, batch_size)
+    print(f"Rebuilt {count} ratio sketches")
+
+def _write_ratios(batch):
+    stored = ratio_documents(compute_ratios([entry["data"] for entry in batch]))
+    requests = [
+        UpdateOne(
+            {"_id": entry["_id"]},
+            {"$set": {"ratios": ratios, "ratios_version": RATIOS_VERSION}},
+        )
+        for entry, ratios in zip(batch, stored)
+    ]
+    result = financial_data.bulk_write(requests, ordered=False)
+    return result.modified_count
+
+def backfill_dates():
+    # Converts ISO string start_date/end_date written by older versions to
+    # native dates and adds period_index, server-side in one update
+    result = financial_data.update_many(
+        {"$or": [{"start_date": {"$type": "string"}}, {"period_index": {"$exists": False}}]},
+        [
+            {
+                "$set": {
+                    "start_date": {"$toDate": "$start_date"},
+                    "end_date": {"$toDate": "$end_date"},
+                }
+            },
+            {
+                "$set": {
+                    "period_index": {
+                        "$add": [
+                            {"$multiply": [{"$year": "$start_date"}, 100]},
+                            {"$month": "$start_date"},
+                        ]
+                    }
+                }
+            },
+        ],
+    )
+    if result.modified_count:
+        users.update_many({}, {"$inc": {"data_version": 1}})
+    print(f"Converted dates on {result.modified_count} documents")
+
+def dedupe_periods():
+    # Keeps the most recently written document of each period so the
+    # period_unique index can be built on collections with old duplicates
+    pipeline = [
+        {"$sort": {"_id": -1}},
+        {
+            "$group": {
+                "_id": {
+                    "username": "$username",
+                    "duration_type": "$duration_type",
+                    "duration": "$duration",
+                },
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1},
+            }
+        },
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    removed = 0
+    affected_users = set()
+    for group in financial_data.aggregate(pipeline, allowDiskUse=True):
+        removed += financial_data.delete_many({"_id": {"$in": group["ids"][1:]}}).deleted_count
+        affected_users.add(group["_id"]["username"])
+    if affected_users:
+        users.update_many(
+            {"username": {"$in": list(affected_users)}}, {"$inc": {"data_version": 1}}
+        )
+        # The removed documents are still counted in the peer sketches
+        build_sketches()
+    print(f"Removed {removed} duplicate period documents")
+
+def create_indexes():
+    # create_index is a no-op when an identical index already exists
+    ok = True
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+        for name in names:
+            if name in existing:
+                collection.drop_index(name)
+                print(f"{collection_name}.{name}: dropped")
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        for keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+                print(f"{collection_name}.{options['name']}: ok")
+            except OperationFailure as e:
+                ok = False
+                print(f"{collection_name}.{options['name']}: failed ({e.details.get('errmsg', e)})")
+                if options.get("unique"):
+                    _report_duplicates(collection, [key for key, _ in keys])
+    return ok
+
+def _report_duplicates(collection, fields):
+    pipeline = [
+        {"$group": {"_id": {field: f"${field}" for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 20},
+    ]
+    for group in collection.aggregate(pipeline):
+        print(f"  duplicate {group['_id']} x{group['count']}")
+
+def _plan_summary(plan):
+    # Walk the winning plan down to its leaf stage (IXSCAN / COLLSCAN)
+    while "inputStage" in plan:
+        plan = plan["inputStage"]
+    if "inputStages" in plan:
+        return ", ".join(_plan_summary(stage) for stage in plan["inputStages"])
+    if plan.get("indexName"):
+        return f"{plan['stage']} {plan['indexName']}"
+    return plan.get("stage", "?")
+
+def explain_queries():
+    sample_user = users.find_one({"role": {"$ne": "admin"}}, {"username": 1, "email": 1}) or {}
+    username = sample_user.get("username", "admin")
+    email = sample_user.get("email", "")
+    hot_queries = [
+        ("users by username", users, {"username": username}),
+        ("users by email", users, {"email": email}),
+        ("financial_data by username", financial_data, {"username": username}),
+        ("users by prefix", users, user_query(username[:3])),
+    ]
+    for label, collection, query in hot_queries:
+        explain = collection.find(query).explain()
+        plan = explain["queryPlanner"]["winningPlan"]
+        stats = explain.get("executionStats", {})
+        print(
+            f"{label}: {_plan_summary(plan)}, "
+            f"docs examined {stats.get('totalDocsExamined', '?')}, "
+            f"returned {stats.get('nReturned', '?')}"
+        )
+
 if __name__ == "__main__":
-    create_admin()
+    parser = argparse.ArgumentParser(description="Database setup and maintenance")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("create-admin", help="Create the default admin user")
+    subparsers.add_parser("create-indexes", help="Create or verify collection indexes")
+    subparsers.add_parser("explain", help="Show index usage for the app's hot queries")
+    subparsers.add_parser("ping", help="Check the database connection")
+    subparsers.add_parser("dedupe-periods", help="Remove duplicate period documents")
+    subparsers.add_parser("backfill-dates", help="Store period dates as native dates")
+    subparsers.add_parser("build-sketches", help="Rebuild the peer percentile sketches")
+    backfill = subparsers.add_parser(
+        "backfill-ratios", help="Recompute stored ratios after a formula change"
+    )
+    backfill.add_argument("--batch-size", type=int, default=1000)
+    backfill.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "backfill-ratios":
+        backfill_ratios(args.batch_size, args.force)
+    elif args.command == "create-indexes":
+        create_indexes()
+    elif args.command == "explain":
+        explain_queries()
+    elif args.command == "backfill-dates":
+        backfill_dates()
+    elif args.command == "build-sketches":
+        build_sketches()
+    elif args.command == "dedupe-periods":
+        dedupe_periods()
+    elif args.command == "ping":
+        ok, detail = check_health()
+        print(f"ok ({detail:.1f} ms)" if ok else f"unreachable: {detail}")
+    elif args.command == "create-admin":
+        create_admin()
+    else:
+        # Full setup; safe to run repeatedly. Data migrations first: the
+        # unique index needs deduplicated periods, and find_periods and the
+        # history pager only see native dates with a period_index.
+        dedupe_periods()
+        backfill_dates()
+        backfill_ratios()
+        build_sketches()
+        create_indexes()
+        create_admin()
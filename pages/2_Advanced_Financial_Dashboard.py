@@ -1,12 +1,34 @@
 # pages/2_Advanced_Financial_Dashboard.py
 import streamlit as st
 from utils.auth import auth
-from datetime import datetime, timedelta, date
-from dateutil.relativedelta import relativedelta
-from utils.db import financial_data, users
-from utils.results import display_financial_period_results
+from utils.db import get_users
+from utils.periods import (
+    DEFAULT_PAGE_SIZE,
+    DURATION_TYPES,
+    WRITE_MODES,
+    build_period_document,
+    cached_period_page,
+    generate_options,
+    get_data_version,
+    process_financial_data,
+    write_period,
+)
+from utils.ingest import import_financial_data
+from utils.ratios import METRIC_LABELS
+from utils.rollups import month_start_of, update_rollups
+from utils.charts import downsampled_points, time_series_figure
+from utils.portfolio import (
+    distribution_range,
+    outlier_fences,
+    portfolio_summary,
+    ratio_distribution,
+    ratio_outliers,
+)
+from utils.trends import TREND_MEASURES, compute_cagr, compute_trends, load_trend_frame
 import pandas as pd
-import math
+import plotly.express as px
+from pymongo.errors import OperationFailure
+from utils.results import display_period_document, display_ratio_history
 
 st.set_page_config(page_title="Advanced Financial Dashboard", layout="wide")
 auth()
@@ -24,96 +46,15 @@ st.markdown(
 )
 
 
-def generate_options(duration_type):
-    current_date = datetime.now()
-    options = []
-
-    if duration_type == "Monthly":
-        for i in range(12):
-            date = current_date - timedelta(days=30 * i)
-            options.append(date.strftime("%b %Y"))
-    elif duration_type == "Quarterly":
-        for i in range(4):
-            date = current_date - timedelta(days=90 * i)
-            quarter = (date.month - 1) // 3 + 1
-            fiscal_year = date.year if date.month > 3 else date.year - 1
-            options.append(f"FY {fiscal_year}-{str(fiscal_year + 1)[-2:]} Q{quarter}")
-    elif duration_type == "Annually":
-        for i in range(5):
-            date = current_date - timedelta(days=365 * i)
-            fiscal_year = date.year if date.month > 3 else date.year - 1
-            options.append(f"FY {fiscal_year}-{str(fiscal_year + 1)[-2:]}")
-
-    return options
-
-
-def generate_date_range(duration, duration_type):
-    today = date.today()
-    if duration_type == "Monthly":
-        start_date = datetime.strptime(duration, "%b %Y").date().replace(day=1)
-        end_date = start_date + relativedelta(months=1, days=-1)
-    elif duration_type == "Quarterly":
-        year, quarter = duration.split(" Q")
-        year = int(year.split("-")[0])
-        quarter = int(quarter)
-        start_date = date(year, 3 * quarter - 2, 1)
-        end_date = start_date + relativedelta(months=3, days=-1)
-    elif duration_type == "Annually":
-        year = int(duration.split("-")[0])
-        start_date = date(year, 4, 1)
-        end_date = date(year + 1, 3, 31)
-    else:
-        raise ValueError("Invalid duration type")
-
-    return start_date, end_date
-
-
-def save_financial_data(username, duration, duration_type, metrics):
-    start_date, end_date = generate_date_range(duration, duration_type)
-    data = {
-        "username": username,
-        "duration": duration,  # e.g., "Jan 2024" or "FY 2023-24 Q4"
-        "duration_type": duration_type,  # "Monthly", "Quarterly", or "Annually"
-        "start_date": start_date.isoformat(),
-        "end_date": end_date.isoformat(),
-        "data": {
-            # Income Statement Metrics
-            "revenue": metrics["revenue"],
-            "operating_profit": metrics["operating_profit"],
-            "ebit": metrics["ebit"],
-            "cogs": metrics["cogs"],
-            "net_profit": metrics["net_profit"],
-            "interest_expense": metrics["interest_expense"],
-            "pbit": metrics["pbit"],
-            # Balance Sheet Metrics
-            "total_assets": metrics["total_assets"],
-            "current_assets": metrics["current_assets"],
-            "liquid_current_assets": metrics["liquid_current_assets"],
-            "cash": metrics["cash"],
-            "average_inventory": metrics["average_inventory"],
-            "total_equity": metrics["total_equity"],
-            "current_liabilities": metrics["current_liabilities"],
-            "cash_equivalents": metrics["cash_equivalents"],
-            "average_accounts_receivable": metrics["average_accounts_receivable"],
-            "average_accounts_payable": metrics["average_accounts_payable"],
-            "total_debt": metrics["total_debt"],
-            "shareholders_equity": metrics["shareholders_equity"],
-            "capital_employed": metrics["capital_employed"],
-            "average_assets": metrics["average_assets"],
-            "average_total_assets": metrics["average_total_assets"],
-            # Sales Metrics
-            "net_sales": metrics["net_sales"],
-            "net_credit_sales": metrics["net_credit_sales"],
-            "net_annual_sales": metrics["net_annual_sales"],
-            "net_credit_purchases": metrics["net_credit_purchases"],
-            "average_working_capital": metrics["average_working_capital"],
-        },
-    }
-
+def save_financial_data(username, duration, duration_type, metrics, mode="replace"):
     try:
-        # Insert the document into MongoDB
-        financial_data.insert_one(data)
-        return True, "Data saved successfully"
+        data = build_period_document(username, duration, duration_type, metrics)
+        # Upsert (or reject) against the unique period key in MongoDB
+        success, message = write_period(data, mode)
+        if success and duration_type == "Monthly":
+            # Keep the derived quarter and fiscal year in step
+            update_rollups(username, [month_start_of(data)])
+        return success, message
     except Exception as e:
         return False, f"Error saving data: {str(e)}"
 
@@ -124,7 +65,7 @@ def add_financial_data():
     with col1:
         duration_type = st.selectbox(
             "Choose Duration Type",
-            ("Monthly", "Quarterly", "Annually"),
+            DURATION_TYPES,
             key="dialog_duration_type",
         )
 
@@ -221,6 +162,14 @@ def add_financial_data():
 
     st.markdown("---")
 
+    write_mode = st.radio(
+        "If this period already exists",
+        list(WRITE_MODES),
+        format_func=WRITE_MODES.get,
+        horizontal=True,
+        key="dialog_write_mode",
+    )
+
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Cancel", type="secondary", use_container_width=True):
@@ -264,9 +213,11 @@ def add_financial_data():
             duration=selected_duration,
             duration_type=duration_type,
             metrics=metrics,
+            mode=write_mode,
         )
 
         if success:
+            reset_period_history()
             st.success(message)
             st.rerun()
         else:
@@ -278,7 +229,7 @@ def admin_add_financial_data(username):
     with col1:
         duration_type = st.selectbox(
             "Choose Duration Type",
-            ("Monthly", "Quarterly", "Annually"),
+            DURATION_TYPES,
             key="dialog_duration_type",
         )
 
@@ -375,6 +326,14 @@ def admin_add_financial_data(username):
 
     st.markdown("---")
 
+    write_mode = st.radio(
+        "If this period already exists",
+        list(WRITE_MODES),
+        format_func=WRITE_MODES.get,
+        horizontal=True,
+        key="dialog_write_mode",
+    )
+
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Cancel", type="secondary", use_container_width=True):
@@ -418,120 +377,355 @@ def admin_add_financial_data(username):
             duration=selected_duration,
             duration_type=duration_type,
             metrics=metrics,
+            mode=write_mode,
         )
 
         if success:
+            reset_period_history()
             st.success(message)
             st.rerun()
         else:
             st.error(message)
 
 
-def process_financial_data(data_list):
-    processed_data = []
-    for entry in data_list:
-        # Create a base dictionary with non-data fields
-        row = {
-            "Period": entry["duration"],
-            "Type": entry["duration_type"],
-            "Date Range": f"{entry['start_date']} to {entry['end_date']}",
+@st.dialog("Import Financial Data", width="large")
+def import_financial_data_dialog(username):
+    st.write(
+        "Upload a CSV or Excel file with one row per period: a Period column "
+        "(e.g. Jan 2024, FY 2023-24 Q4), a Type column (Monthly, Quarterly or "
+        "Annually) and one column per financial metric."
+    )
+    st.download_button(
+        "Download template",
+        ",".join(["Period", "Type"] + list(METRIC_LABELS.values())) + "\n",
+        file_name="financial_data_template.csv",
+        mime="text/csv",
+    )
+    uploaded_file = st.file_uploader("File", type=["csv", "xlsx"])
+    write_mode = st.radio(
+        "If a period already exists",
+        list(WRITE_MODES),
+        format_func=WRITE_MODES.get,
+        horizontal=True,
+        key="import_write_mode",
+    )
+
+    if uploaded_file and st.button("Import", type="primary", use_container_width=True):
+        status = st.empty()
+        try:
+            report = import_financial_data(
+                uploaded_file,
+                username,
+                mode=write_mode,
+                progress=lambda rows: status.write(f"{rows:,} rows read..."),
+            )
+        except ValueError as e:
+            st.error(str(e))
+            return
+
+        reset_period_history()
+        status.success(
+            f"Imported {report['inserted']:,} new and {report['replaced']:,} "
+            f"replaced periods from {report['rows']:,} rows in "
+            f"{report['seconds']:.1f}s ({report['rows_per_second']:,.0f} rows/s)"
+        )
+        if report["errors"]:
+            st.warning(f"{len(report['errors']):,} rows were not imported")
+            st.dataframe(
+                pd.DataFrame(report["errors"], columns=["Row", "Error"]),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+
+PAGE_SIZE_OPTIONS = sorted({12, 24, 48, 96, DEFAULT_PAGE_SIZE})
+
+# Numbers stay numeric (and sortable); formatting happens in the browser
+PERIOD_TABLE_COLUMNS = {
+    "Derived": st.column_config.CheckboxColumn(
+        "Derived", help="Summed from the monthly data rather than entered"
+    ),
+    "Complete": st.column_config.CheckboxColumn(
+        "Complete", help="Unchecked while a derived period is missing months"
+    ),
+    **{
+        label: st.column_config.NumberColumn(label, format="%.2f")
+        for label in METRIC_LABELS.values()
+    },
+}
+
+
+def reset_period_history():
+    st.session_state.pop("period_history", None)
+    st.session_state.pop("data_version", None)
+    # Row positions refer to the loaded documents, so drop the selection too
+    st.session_state.pop("period_table", None)
+
+
+def current_data_version(username):
+    # Read from MongoDB once per full run (the main block drops it) and after
+    # a write from this session; fragment reruns such as row selections
+    # reuse it
+    cached = st.session_state.get("data_version")
+    if cached is None or cached[0] != username:
+        cached = (username, get_data_version(username))
+        st.session_state.data_version = cached
+    return cached[1]
+
+
+def load_period_history(username, page_size):
+    # Pages loaded so far for this user, kept across reruns together with the
+    # table built from them; reloaded when anyone writes to the user's data
+    data_version = current_data_version(username)
+    history = st.session_state.get("period_history")
+    if (
+        history is None
+        or history["username"] != username
+        or history["page_size"] != page_size
+        or history["data_version"] != data_version
+    ):
+        docs, after, has_more = cached_period_page(
+            username, data_version, page_size=page_size
+        )
+        history = {
+            "username": username,
+            "page_size": page_size,
+            "data_version": data_version,
+            "docs": docs,
+            "after": after,
+            "has_more": has_more,
+            "table": process_financial_data(docs),
         }
+        st.session_state.period_history = history
+        st.session_state.pop("period_table", None)
+    return history
+
+
+def load_more_periods():
+    history = st.session_state.period_history
+    docs, after, has_more = cached_period_page(
+        history["username"],
+        history["data_version"],
+        after=history["after"],
+        page_size=history["page_size"],
+    )
+    history["docs"].extend(docs)
+    history["after"] = after
+    history["has_more"] = has_more
+    history["table"] = process_financial_data(history["docs"])
+
+
+@st.fragment
+def period_history_fragment(username):
+    # Table interactions (selection, paging) rerun only this fragment, not
+    # auth(), the user list query or the rest of the page
+    page_size = st.selectbox(
+        "Periods per page",
+        PAGE_SIZE_OPTIONS,
+        index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE),
+        key="period_page_size",
+    )
+    history = load_period_history(username, page_size)
+    data_list = history["docs"]
+
+    # One row-selectable table instead of a button per period; selection is
+    # resolved against the already-loaded documents, no query needed
+    event = st.dataframe(
+        history["table"],
+        hide_index=True,
+        use_container_width=True,
+        column_config=PERIOD_TABLE_COLUMNS,
+        on_select="rerun",
+        selection_mode="single-row",
+        key="period_table",
+    )
+    selected_rows = event.selection.rows
+    preview_data = data_list[selected_rows[0]] if selected_rows else None
+
+    if history["has_more"]:
+        st.button("Load more", on_click=load_more_periods)
+    display_ratio_history(data_list)
+
+    if preview_data:
+        period_preview_fragment(preview_data)
+
+
+@st.fragment
+def period_preview_fragment(preview_data):
+    st.markdown("---")
+    st.header(
+        f"Financial Analysis Results for {preview_data['duration_type']} - {preview_data['duration']}"
+    )
+    display_period_document(preview_data)
 
-        # Add all metrics from the data dictionary
-        for key, value in entry["data"].items():
-            # Convert snake_case to Title Case for better display
-            display_key = " ".join(word.capitalize() for word in key.split("_"))
-            row[display_key] = value
 
-        processed_data.append(row)
+@st.fragment
+def trends_fragment(username):
+    # Growth, rolling averages and CAGR over the whole history of one period
+    # type; the frame is cached per (username, data_version, period type)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        duration_type = st.selectbox("Period Type", DURATION_TYPES, key="trend_type")
+    with col2:
+        measure = st.selectbox(
+            "Measure",
+            list(TREND_MEASURES),
+            format_func=TREND_MEASURES.get,
+            key="trend_measure",
+        )
+    with col3:
+        window = st.number_input(
+            "Rolling window (periods)", min_value=2, max_value=24, value=3, key="trend_window"
+        )
 
-    # Create DataFrame and set display options
-    df = pd.DataFrame(processed_data)
+    frame = load_trend_frame(username, current_data_version(username), duration_type)
+    if frame.empty:
+        st.info(f"No {duration_type.lower()} data yet.")
+        return
+
+    series = [column for column in frame.columns if column != "Period"]
+    selected = st.multiselect(
+        "Metrics and ratios",
+        series,
+        default=["Revenue", "Net Profit Margin"],
+        key="trend_series",
+    )
+    trends = compute_trends(frame, duration_type, window)
+    if selected:
+        # Narrowing the range re-plots that window from the full-resolution
+        # history; every trace is downsampled to POINT_BUDGET points
+        periods = frame["Period"].tolist()
+        first, last = st.select_slider(
+            "Range", options=periods, value=(periods[0], periods[-1]), key="trend_range"
+        )
+        start = frame.index[periods.index(first)]
+        end = frame.index[periods.index(last)]
+        chart_data = trends[measure]
+        st.plotly_chart(
+            time_series_figure(chart_data, selected, TREND_MEASURES[measure], start, end),
+            use_container_width=True,
+        )
+        total, shown = downsampled_points(chart_data, selected, start, end)
+        if shown < total:
+            st.caption(f"Showing {shown:,} of {total:,} points; narrow the range for more detail.")
+
+    with st.expander("Compound Annual Growth Rate", expanded=False):
+        st.dataframe(
+            compute_cagr(frame).round(2).to_frame(),
+            use_container_width=True,
+        )
 
-    # Format numeric columns
-    numeric_columns = df.select_dtypes(include=["float64", "int64"]).columns
-    for col in numeric_columns:
-        df[col] = df[col].apply(lambda x: "{:,.2f}".format(x))
 
-    return df
+@st.fragment
+def portfolio_fragment():
+    # Ratio distributions across all users, aggregated in MongoDB; only
+    # summary rows, histogram buckets and the top outliers reach the app
+    col1, col2 = st.columns(2)
+    with col1:
+        duration_type = st.selectbox(
+            "Period Type", DURATION_TYPES, index=2, key="portfolio_type"
+        )
+    with col2:
+        duration = st.selectbox(
+            "Period",
+            [None] + generate_options(duration_type),
+            format_func=lambda label: label or "Latest period of each user",
+            key="portfolio_period",
+        )
+
+    try:
+        summary, users = portfolio_summary(duration_type, duration)
+    except OperationFailure as e:
+        # $percentile (the quartiles) needs MongoDB 7.0 or later
+        st.error(f"Could not compute the portfolio summary: {(e.details or {}).get('errmsg', e)}")
+        return
+    if summary.empty:
+        st.info("No data for this period yet.")
+        return
+    st.caption(f"{users:,} users")
+    st.dataframe(
+        summary,
+        use_container_width=True,
+        column_config={
+            column: st.column_config.NumberColumn(column, format="%.2f")
+            for column in ["Mean", "Q1", "Median", "Q3", "Min", "Max"]
+        },
+    )
+
+    name = st.selectbox("Ratio", list(summary.index), key="portfolio_ratio")
+    low, high = distribution_range(summary, name)
+    if not low < high:
+        st.info(f"Not enough spread in {name} to draw a distribution.")
+        return
+
+    distribution, outliers = ratio_distribution(duration_type, name, low, high, duration)
+    distribution["Range"] = (
+        distribution["From"].map("{:,.2f}".format)
+        + " to "
+        + distribution["To"].map("{:,.2f}".format)
+    )
+    st.plotly_chart(
+        px.bar(distribution, x="Range", y="Users", title=f"{name} across users"),
+        use_container_width=True,
+    )
+    if outliers:
+        st.subheader(f"Outliers ({outliers:,})")
+        fence_low, fence_high = outlier_fences(summary, name)
+        st.dataframe(
+            ratio_outliers(duration_type, name, fence_low, fence_high, duration),
+            hide_index=True,
+            use_container_width=True,
+        )
 
 
 if st.session_state.authenticated:
+    # A full run picks up writes made elsewhere (other sessions, imports)
+    st.session_state.pop("data_version", None)
     st.title("Advanced Financial Dashboard")
     st.write("Welcome to the advanced financial dashboard!")
     st.markdown("---")
     if st.session_state.user_role == "admin":
-        user_list = list(users.find({"role": {"$ne": "admin"}}, {"password": 0}))
-        col1, col2 = st.columns(2)
-        with col1:
-            selected_user = st.selectbox(
-                "Select User",
-                [user["username"] for user in user_list],
-                key="user_select",
-            )
-        if st.button("Add Financial Data"):
-            admin_add_financial_data(selected_user)
-        if selected_user:
-            user_financial_data = financial_data.find({"username": selected_user})
-            data_list = list(user_financial_data)
-            preview_data = None
-            num_rows = math.ceil(len(data_list) / 6)
-            for row in range(num_rows):
-                cols = st.columns(6)
-                for i in range(6):
-                    index = row * 6 + i
-                    if index < len(data_list):
-                        data = data_list[index]
-                        with cols[i]:
-                            if st.button(
-                                f"{data['duration_type']} - {data['duration']}",
-                                key=f"btn_{index}",
-                                use_container_width=True,
-                            ):
-                                preview_data = data
-
-            df = process_financial_data(data_list)
-            st.dataframe(df, hide_index=True, use_container_width=True)
-
-            if preview_data:
-                st.markdown("---")
-                st.header(
-                    f"Financial Analysis Results for {preview_data['duration_type']} - {preview_data['duration']}"
+        users_tab, portfolio_tab = st.tabs(["Users", "Portfolio"])
+        with users_tab:
+            user_list = list(
+                get_users().find({"role": {"$ne": "admin"}}, {"password": 0})
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                selected_user = st.selectbox(
+                    "Select User",
+                    [user["username"] for user in user_list],
+                    key="user_select",
                 )
-                display_financial_period_results(**preview_data["data"])
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Add Financial Data"):
+                    admin_add_financial_data(selected_user)
+            with col2:
+                if st.button("Import Financial Data"):
+                    import_financial_data_dialog(selected_user)
+            if selected_user:
+                history_tab, trends_tab = st.tabs(["History", "Trends"])
+                with history_tab:
+                    period_history_fragment(selected_user)
+                with trends_tab:
+                    trends_fragment(selected_user)
+        with portfolio_tab:
+            portfolio_fragment()
     elif st.session_state.user_role == "user":
-        if st.button("Add Financial Data"):
-            add_financial_data()
-
-        user_financial_data = financial_data.find(
-            {"username": st.session_state.user["username"]}
-        )
-        data_list = list(user_financial_data)
-        preview_data = None
-        num_rows = math.ceil(len(data_list) / 6)
-        for row in range(num_rows):
-            cols = st.columns(6)
-            for i in range(6):
-                index = row * 6 + i
-                if index < len(data_list):
-                    data = data_list[index]
-                    with cols[i]:
-                        if st.button(
-                            f"{data['duration_type']} - {data['duration']}",
-                            key=f"btn_{index}",
-                            use_container_width=True,
-                        ):
-                            preview_data = data
-
-        df = process_financial_data(data_list)
-        st.dataframe(df, hide_index=True, use_container_width=True)
-
-        if preview_data:
-            st.markdown("---")
-            st.header(
-                f"Financial Analysis Results for {preview_data['duration_type']} - {preview_data['duration']}"
-            )
-            display_financial_period_results(**preview_data["data"])
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Add Financial Data"):
+                add_financial_data()
+        with col2:
+            if st.button("Import Financial Data"):
+                import_financial_data_dialog(st.session_state.user["username"])
+
+        history_tab, trends_tab = st.tabs(["History", "Trends"])
+        with history_tab:
+            period_history_fragment(st.session_state.user["username"])
+        with trends_tab:
+            trends_fragment(st.session_state.user["username"])
 
 else:
     st.title("Advanced Financial Dashboard")
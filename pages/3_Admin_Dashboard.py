@@ -1,9 +1,22 @@
 # pages/3_Admin_Dashboard.py
 import streamlit as st
-from utils.db import users
-import bcrypt
+from utils.db import get_users
+from utils.passwords import hash_password
+from pymongo.errors import DuplicateKeyError
 from utils.auth import auth
+from utils.sessions import revoke_sessions
+from utils.users import (
+    USER_COLUMNS,
+    USER_PAGE_SIZE,
+    USER_SORTS,
+    create_users,
+    fetch_user_page,
+    search_usernames,
+)
+from utils.throttle import THROTTLE_BACKEND, throttle_stats
 import time
+import math
+import pandas as pd
 
 
 st.set_page_config(page_title="Admin Dashboard", layout="wide")
@@ -22,9 +35,117 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# USER_PAGE_SIZE (the default) is always one of the choices
+USER_PAGE_SIZE_OPTIONS = sorted({25, 50, 100, USER_PAGE_SIZE})
+
+
+def reset_user_page():
+    st.session_state.user_page = 1
+
+
+@st.fragment
+def user_table_fragment():
+    # One page of users at a time; search and sort run against the indexes
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    with col1:
+        prefix = st.text_input(
+            "Search username or email",
+            placeholder="Starts with...",
+            key="user_search",
+            on_change=reset_user_page,
+        )
+    with col2:
+        sort = st.selectbox(
+            "Sort by", list(USER_SORTS), key="user_sort", on_change=reset_user_page
+        )
+    with col3:
+        descending = st.toggle("Descending", key="user_desc", on_change=reset_user_page)
+    with col4:
+        page_size = st.selectbox(
+            "Rows",
+            USER_PAGE_SIZE_OPTIONS,
+            index=USER_PAGE_SIZE_OPTIONS.index(USER_PAGE_SIZE),
+            key="user_page_size",
+            on_change=reset_user_page,
+        )
+
+    page = st.session_state.get("user_page", 1)
+    users, total = fetch_user_page(prefix, sort, descending, page - 1, page_size)
+    pages = max(1, math.ceil(total / page_size))
+    if page > pages:
+        # Users were deleted since the page was chosen
+        page = st.session_state.user_page = pages
+        users, total = fetch_user_page(prefix, sort, descending, page - 1, page_size)
+
+    st.dataframe(
+        pd.DataFrame(users, columns=["username", "name", "email", "role"]),
+        hide_index=True,
+        use_container_width=True,
+    )
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.number_input("Page", min_value=1, max_value=pages, key="user_page")
+    with col2:
+        st.caption(f"{total:,} users, page {min(page, pages)} of {pages}")
+
+
+def bulk_create_users():
+    st.write(
+        "Upload a CSV with Username, Name, Email and Password columns and an "
+        "optional Role column (user or admin; defaults to user)."
+    )
+    st.download_button(
+        "Download template",
+        ",".join(label.capitalize() for label in USER_COLUMNS) + "\n",
+        file_name="users_template.csv",
+        mime="text/csv",
+    )
+    uploaded_file = st.file_uploader("Users CSV", type=["csv"], key="bulk_users_file")
+
+    if uploaded_file and st.button("Create Users", type="primary"):
+        bar = st.progress(0.0, text="Hashing passwords...")
+        try:
+            report = create_users(
+                uploaded_file,
+                progress=lambda done, total: bar.progress(
+                    done / total, text=f"Hashed {done:,} of {total:,} passwords"
+                ),
+            )
+        except ValueError as e:
+            bar.empty()
+            st.error(str(e))
+            return
+        bar.empty()
+
+        created = int((report["Status"] == "Created").sum())
+        st.success(f"Created {created:,} of {len(report):,} users")
+        if created < len(report):
+            st.warning(f"{len(report) - created:,} rows were not created")
+        st.dataframe(report, hide_index=True, use_container_width=True)
+
+
+def user_picker(label, key):
+    # Search-as-you-type: only the first matches of the typed prefix are
+    # loaded as options, never the whole collection
+    prefix = st.text_input(
+        f"{label} (type to search)", key=f"{key}_search", placeholder="Username or email"
+    )
+    matches = search_usernames(prefix)
+    if not matches:
+        st.caption("No matching users")
+        return None
+    return st.selectbox(label, matches, key=key)
+
+
 if st.session_state.authenticated and st.session_state.user_role == "admin":
     st.title("Admin Dashboard")
-    
+
+    with st.expander("Login throttling", expanded=False):
+        stats = throttle_stats()
+        cols = st.columns(len(stats))
+        for col, (name, value) in zip(cols, stats.items()):
+            col.metric(name.replace("_", " ").capitalize(), f"{value:,}")
+        st.caption(f"Since this server process started ({THROTTLE_BACKEND} backend)")
 
     # Create tabs for different admin functions
     tab1, tab2, tab3 = st.tabs(["Create User", "Manage Users", "Delete Users"])
@@ -46,71 +167,62 @@ if st.session_state.authenticated and st.session_state.user_role == "admin":
                     st.error("All fields are required!")
                 elif new_password != confirm_password:
                     st.error("Passwords do not match!")
-                elif users.find_one({"username": new_username}):
+                elif get_users().find_one({"username": new_username}):
                     st.error("Username already exists!")
-                elif users.find_one({"email": new_email}):
+                elif get_users().find_one({"email": new_email}):
                     st.error("Email already registered!")
                 else:
-                    # Hash the password
-                    hashed_password = bcrypt.hashpw(
-                        new_password.encode("utf-8"), bcrypt.gensalt()
-                    )
-
                     # Create new user document
                     new_user = {
                         "username": new_username,
                         "email": new_email,
-                        "password": hashed_password.decode("utf-8"),
+                        "password": hash_password(new_password),
                         "role": new_role,
                         "name": new_name
                     }
 
                     # Insert into database
-                    users.insert_one(new_user)
-                    st.success(f"User {new_username} created successfully!")
-                    time.sleep(2)
-                    st.rerun()
+                    try:
+                        get_users().insert_one(new_user)
+                    except DuplicateKeyError:
+                        st.error("Username or email already registered!")
+                    else:
+                        st.success(f"User {new_username} created successfully!")
+                        time.sleep(2)
+                        st.rerun()
+
+        st.header("Bulk Create Users")
+        bulk_create_users()
 
     with tab2:
         st.header("User Management")
-
-        # Display all users
-        user_list = list(users.find({}, {"password": 0}))
-
-        # Create a DataFrame for better display
-        import pandas as pd
-
-        df = pd.DataFrame(user_list)
-        if not df.empty:
-            df = df.drop("_id", axis=1)
-            st.dataframe(df, hide_index=True)
+        user_table_fragment()
 
         # User Role Management
         st.subheader("Modify User Role")
         col1, col2 = st.columns(2)
         with col1:
-            selected_user = st.selectbox(
-                "Select User", [user["username"] for user in user_list]
-            )
+            selected_user = user_picker("Select User", "role_user")
         with col2:
             new_role = st.selectbox("New Role", ["user", "admin"])
 
-        if st.button("Update Role"):
-            users.update_one({"username": selected_user}, {"$set": {"role": new_role}})
+        if st.button("Update Role", disabled=selected_user is None):
+            get_users().update_one({"username": selected_user}, {"$set": {"role": new_role}})
+            # Tokens carry the role; make the user log in again
+            revoke_sessions(selected_user)
             st.success(f"Updated role for {selected_user} to {new_role}")
             st.rerun()
 
     with tab3:
         st.header("Delete User")
-        user_to_delete = st.selectbox(
-            "Select User to Delete", [user["username"] for user in user_list]
-        )
+        user_to_delete = user_picker("Select User to Delete", "delete_user")
 
-        if st.button("Delete User", type="primary"):
+        if st.button("Delete User", type="primary", disabled=user_to_delete is None):
             if user_to_delete == st.session_state.username:
                 st.error("You cannot delete your own account!")
             else:
-                users.delete_one({"username": user_to_delete})
+                get_users().delete_one({"username": user_to_delete})
+                revoke_sessions(user_to_delete)
                 st.success(f"Deleted user {user_to_delete}")
                 st.rerun()
 
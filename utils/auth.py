@@ -1,36 +1,138 @@
 # app.py
+import json
 import streamlit as st
-import bcrypt
-from utils.db import users
+import streamlit.components.v1 as components
+from pymongo.errors import DuplicateKeyError
+from utils.db import get_users
+from utils.passwords import hash_password, needs_rehash, verify_password
+from utils.sessions import (
+    LEGACY_SESSION_PARAM,
+    SESSION_COOKIE,
+    SESSION_COOKIE_SECURE,
+    SESSION_TTL_SECONDS,
+    issue_token,
+    revoke_token,
+    verify_token,
+)
+from utils.throttle import check_login_attempt
 
 
-def login_user(username, password):
-    user = users.find_one({"username": username})
-    if user and bcrypt.checkpw(
-        password.encode("utf-8"), user["password"].encode("utf-8")
-    ):
-        st.session_state.authenticated = True
-        st.session_state.user_role = user["role"]
-        st.session_state.username = username
-        st.session_state.user = user
-        return True
-    return False
+def start_session(profile, token=None):
+    # Only the slim profile is kept in the session, never the password hash
+    st.session_state.authenticated = True
+    st.session_state.user_role = profile["role"]
+    st.session_state.username = profile["username"]
+    st.session_state.user = profile
+    if token is None:
+        # New login: the browser stores the token on the next render
+        token = issue_token(profile)
+        st.session_state.session_cookie = token
+    st.session_state.session_token = token
+
+
+def clear_session():
+    st.session_state.user = None
+    st.session_state.authenticated = False
+    st.session_state.user_role = None
+    st.session_state.username = None
+    st.session_state.session_token = None
+
+
+def end_session():
+    # Logout: the token stops working everywhere, not just in this tab
+    if st.session_state.get("session_token"):
+        revoke_token(st.session_state.session_token)
+    clear_session()
+    st.session_state.session_cookie = ""
+
+
+def write_session_cookie():
+    # Sets (or, with an empty value, deletes) the session cookie from a
+    # zero-height component: its iframe is same-origin, so the cookie belongs
+    # to the app. st.context.cookies only sees it from the next page load on;
+    # until then the session keeps the token in session_state.
+    value = st.session_state.pop("session_cookie", None)
+    if value is None:
+        return
+    attributes = f"; Path=/; Max-Age={SESSION_TTL_SECONDS if value else 0}; SameSite=Strict"
+    if SESSION_COOKIE_SECURE:
+        attributes += "; Secure"
+    cookie = json.dumps(f"{SESSION_COOKIE}={value}{attributes}")
+    components.html(f"<script>window.parent.document.cookie = {cookie};</script>", height=0)
+
+
+def restore_session():
+    # Checks the signed token on every run (HMAC and the cached revocation
+    # list, no user lookup or bcrypt): a reload starts a new Streamlit
+    # session that logs back in from the session cookie, and a live session
+    # ends once its user is revoked, deleted or demoted, or logged out elsewhere
+    st.query_params.pop(LEGACY_SESSION_PARAM, None)
+    authenticated = st.session_state.get("authenticated")
+    if authenticated:
+        token = st.session_state.get("session_token")
+    else:
+        token = st.context.cookies.get(SESSION_COOKIE)
+    profile = verify_token(token) if token else None
+    if profile is None:
+        if authenticated:
+            clear_session()
+            st.session_state.session_cookie = ""
+        elif token and st.session_state.get("dropped_cookie") != token:
+            # The cookie read at page load stays the same for the whole
+            # session; delete it from the browser once
+            st.session_state.dropped_cookie = token
+            st.session_state.session_cookie = ""
+    elif not authenticated:
+        start_session(profile, token)
+    write_session_cookie()
+    return profile is not None
+
+
+def login_user(username, password, client=None):
+    # Over-limit attempts are rejected before the user lookup and bcrypt
+    allowed, retry_after = check_login_attempt(username, client)
+    if not allowed:
+        return False, f"Too many login attempts. Try again in {retry_after:.0f} seconds"
+
+    user = get_users().find_one({"username": username})
+    if user and verify_password(password, user["password"]):
+        if needs_rehash(user["password"]):
+            # Move the stored hash to the configured work factor; the filter
+            # skips the write if the password changed in the meantime
+            get_users().update_one(
+                {"_id": user["_id"], "password": user["password"]},
+                {"$set": {"password": hash_password(password)}},
+            )
+        start_session(
+            {
+                "username": user["username"],
+                "name": user.get("name") or user["username"],
+                "role": user["role"],
+            }
+        )
+        return True, "Logged in successfully!"
+    return False, "Invalid username or password"
 
 
 def register_user(username, password, email):
-    if users.find_one({"username": username}):
+    if get_users().find_one({"username": username}):
         return False, "Username already exists"
-    if users.find_one({"email": email}):
+    if get_users().find_one({"email": email}):
         return False, "Email already registered"
 
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
     user = {
         "username": username,
-        "password": hashed_password.decode("utf-8"),
+        "password": hash_password(password),
         "email": email,
         "role": "user",
     }
-    users.insert_one(user)
+    try:
+        get_users().insert_one(user)
+    except DuplicateKeyError as e:
+        # Lost a race against a concurrent registration (unique indexes)
+        if "email" in str(e):
+            return False, "Email already registered"
+        return False, "Username already exists"
     return True, "Registration successful"
 
 
@@ -42,6 +144,7 @@ def auth():
         st.session_state.user_role = None
     if "username" not in st.session_state:
         st.session_state.username = None
+    restore_session()
 
     # Sidebar login/register system
     with st.sidebar:
@@ -57,11 +160,12 @@ def auth():
                 )
 
                 if st.button("Login"):
-                    if login_user(login_username, login_password):
-                        st.success("Logged in successfully!")
+                    success, message = login_user(login_username, login_password)
+                    if success:
+                        st.success(message)
                         st.rerun()
                     else:
-                        st.error("Invalid username or password")
+                        st.error(message)
 
             with tab2:
                 st.subheader("Register")
@@ -95,8 +199,5 @@ def auth():
             st.title(f"Welcome, {name}!")
             st.write(f"Role: {role}")
             if st.button("Logout"):
-                st.session_state.user = None
-                st.session_state.authenticated = False
-                st.session_state.user_role = None
-                st.session_state.username = None
+                end_session()
                 st.rerun()
@@ -0,0 +1,117 @@
+# utils/charts.py
+import os
+import numpy as np
+import plotly.graph_objects as go
+
+
+# Points per trace sent to the browser; longer series are downsampled
+POINT_BUDGET = int(os.getenv("CHART_POINT_BUDGET", "1000"))
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def lttb_indices(x, y, budget):
+    # Largest-Triangle-Three-Buckets: positions of `budget` points that keep
+    # the visual shape of the series. x and y are float arrays without NaN.
+    n = len(x)
+    if budget >= n or budget < 3:
+        return np.arange(n)
+
+    # Bucket edges for the n - 2 inner points; first and last are always kept
+    edges = np.linspace(1, n - 1, budget - 1).astype(int)
+    selected = np.empty(budget, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(budget - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(area.argmax())
+        selected[i + 1] = previous
+    return selected
+
+
+def minmax_indices(y, budget):
+    # Minimum and maximum of each of budget / 2 buckets, in order; cheaper
+    # than LTTB and keeps every spike
+    n = len(y)
+    if budget >= n or budget < 4:
+        return np.arange(n)
+
+    buckets = budget // 2
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    starts = edges[:-1]
+    lowest = np.minimum.reduceat(y, starts)
+    highest = np.maximum.reduceat(y, starts)
+
+    selected = []
+    for start, end, low, high in zip(starts, edges[1:], lowest, highest):
+        window = y[start:end]
+        selected.append(start + int(np.argmax(window == low)))
+        selected.append(start + int(np.argmax(window == high)))
+    return np.unique(selected)
+
+
+def downsample(series, budget=POINT_BUDGET, method="lttb"):
+    # Series indexed by date -> at most `budget` points, gaps (NaN) dropped
+    series = series.dropna()
+    if len(series) <= budget:
+        return series
+
+    if method == "lttb":
+        x = series.index.to_numpy(dtype="datetime64[ns]").astype("int64").astype("float64")
+        positions = lttb_indices(x, series.to_numpy(dtype="float64"), budget)
+    elif method == "minmax":
+        positions = minmax_indices(series.to_numpy(dtype="float64"), budget)
+    else:
+        raise ValueError(f"Invalid downsampling method: {method}")
+    return series.iloc[positions]
+
+
+def time_series_figure(
+    frame,
+    columns,
+    title=None,
+    start=None,
+    end=None,
+    budget=POINT_BUDGET,
+    method="lttb",
+):
+    # WebGL line chart of `columns` of a date-indexed frame. Only [start, end]
+    # is plotted and each trace is downsampled to `budget` points, so zooming
+    # in (narrowing the range) shows more of the full-resolution data.
+    window = frame.loc[start:end, columns]
+    fig = go.Figure()
+    for column in columns:
+        series = downsample(window[column], budget, method)
+        fig.add_trace(
+            go.Scattergl(
+                x=series.index,
+                y=series.to_numpy(),
+                mode="lines+markers" if len(series) <= 60 else "lines",
+                name=column,
+            )
+        )
+    fig.update_layout(
+        title=title,
+        hovermode="x unified",
+        legend={"orientation": "h", "y": -0.2},
+    )
+    return fig
+
+
+def downsampled_points(frame, columns, start=None, end=None, budget=POINT_BUDGET):
+    # (points available, points plotted) for the chart caption
+    window = frame.loc[start:end, columns]
+    total = int(window.notna().sum().sum())
+    shown = sum(min(int(window[column].notna().sum()), budget) for column in columns)
+    return total, shown
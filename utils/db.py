@@ -1,13 +1,62 @@
-# app.py
+# utils/db.py
 import streamlit as st
 import os
+import time
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
 
-# Load environment variables and setup MongoDB
+# Load environment variables; the MongoDB client is created on first use
 load_dotenv()
-client = MongoClient(os.getenv("MONGODB_URI"))
-db = client["financial_app"]
-users = db.users
-financial_data = db.financial_data
+
+DATABASE_NAME = "financial_app"
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def client_options():
+    # Pool and timeout settings, overridable through the environment.
+    # zlib ships with Python; add "zstd"/"snappy" when those packages are
+    # installed.
+    return {
+        "maxPoolSize": _env_int("MONGODB_MAX_POOL_SIZE", 20),
+        "minPoolSize": _env_int("MONGODB_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": _env_int("MONGODB_MAX_IDLE_TIME_MS", 300000),
+        "serverSelectionTimeoutMS": _env_int("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "connectTimeoutMS": _env_int("MONGODB_CONNECT_TIMEOUT_MS", 5000),
+        "socketTimeoutMS": _env_int("MONGODB_SOCKET_TIMEOUT_MS", 30000),
+        "compressors": os.getenv("MONGODB_COMPRESSORS", "zlib"),
+        "appname": "financial-dashboard",
+    }
+
+
+@st.cache_resource
+def get_client():
+    # One client (and connection pool) per process, shared by all sessions.
+    # connect=False defers all network I/O to the first operation.
+    return MongoClient(os.getenv("MONGODB_URI"), connect=False, **client_options())
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+def get_users():
+    return get_db().users
+
+
+def get_financial_data():
+    return get_db().financial_data
+
+
+def check_health():
+    # Round-trip ping; returns (ok, latency in ms or error message)
+    start = time.perf_counter()
+    try:
+        get_client().admin.command("ping")
+    except Exception as e:
+        return False, str(e)
+    return True, (time.perf_counter() - start) * 1000
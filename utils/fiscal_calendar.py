@@ -0,0 +1,136 @@
+# utils/fiscal_calendar.py
+import os
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+
+# First month of the fiscal year (4 = April-March)
+FISCAL_YEAR_START_MONTH = int(os.getenv("FISCAL_YEAR_START_MONTH", "4"))
+
+# "calendar": Qn is the calendar quarter the period falls in (the labels the
+# app has always stored, e.g. Oct-Dec 2023 -> "FY 2023-24 Q4");
+# "fiscal": Q1 is the first quarter of the fiscal year
+QUARTER_NUMBERING = os.getenv("FISCAL_QUARTER_NUMBERING", "calendar")
+
+# Years covered by the precomputed tables
+FIRST_FISCAL_YEAR = int(os.getenv("FISCAL_CALENDAR_FIRST_YEAR", "1990"))
+LAST_FISCAL_YEAR = int(
+    os.getenv("FISCAL_CALENDAR_LAST_YEAR", str(date.today().year + 10))
+)
+
+# Weeks per period in a 4-4-5 quarter
+WEEK_PATTERN_445 = (4, 4, 5)
+
+
+def fiscal_year_name(fiscal_year):
+    if FISCAL_YEAR_START_MONTH == 1:
+        return f"FY {fiscal_year}"
+    return f"FY {fiscal_year}-{str(fiscal_year + 1)[-2:]}"
+
+
+def fiscal_year_start(fiscal_year):
+    return date(fiscal_year, FISCAL_YEAR_START_MONTH, 1)
+
+
+def _quarter_number(quarter_start, fiscal_ordinal):
+    if QUARTER_NUMBERING == "fiscal":
+        return fiscal_ordinal
+    return (quarter_start.month - 1) // 3 + 1
+
+
+def _build_table(duration_type):
+    rows = []
+    for fiscal_year in range(FIRST_FISCAL_YEAR, LAST_FISCAL_YEAR + 1):
+        year_start = fiscal_year_start(fiscal_year)
+        year_end = year_start + relativedelta(years=1, days=-1)
+        name = fiscal_year_name(fiscal_year)
+
+        if duration_type == "Annually":
+            rows.append((name, year_start, year_end, fiscal_year))
+        elif duration_type == "Quarterly":
+            for i in range(4):
+                start = year_start + relativedelta(months=3 * i)
+                end = start + relativedelta(months=3, days=-1)
+                label = f"{name} Q{_quarter_number(start, i + 1)}"
+                rows.append((label, start, end, fiscal_year))
+        elif duration_type == "Monthly":
+            for i in range(12):
+                start = year_start + relativedelta(months=i)
+                end = start + relativedelta(months=1, days=-1)
+                rows.append((start.strftime("%b %Y"), start, end, fiscal_year))
+        elif duration_type == "4-4-5":
+            # 52 weeks from the fiscal year start; the last period absorbs
+            # the remaining days so periods always tile the fiscal year
+            start = year_start
+            for i in range(12):
+                weeks = WEEK_PATTERN_445[i % 3]
+                end = start + timedelta(weeks=weeks, days=-1)
+                if i == 11:
+                    end = year_end
+                rows.append((f"{name} P{i + 1:02d}", start, end, fiscal_year))
+                start = end + timedelta(days=1)
+        else:
+            raise ValueError("Invalid duration type")
+
+    table = pd.DataFrame(rows, columns=["label", "start", "end", "fiscal_year"])
+    table["start"] = pd.to_datetime(table["start"])
+    table["end"] = pd.to_datetime(table["end"])
+    return table
+
+
+@lru_cache(maxsize=None)
+def period_table(duration_type):
+    # Every period of the given type between FIRST_FISCAL_YEAR and
+    # LAST_FISCAL_YEAR, ordered by start
+    return _build_table(duration_type)
+
+
+@lru_cache(maxsize=None)
+def _label_index(duration_type):
+    table = period_table(duration_type)
+    return {
+        label: (start.date(), end.date())
+        for label, start, end in zip(table["label"], table["start"], table["end"])
+    }
+
+
+def period_range(duration, duration_type):
+    # O(1) label -> (start date, end date)
+    try:
+        return _label_index(duration_type)[duration.strip()]
+    except KeyError:
+        raise ValueError(f"Unknown {duration_type.lower()} period '{duration}'") from None
+
+
+def assign_periods(dates, duration_type):
+    # Vectorized: label of the period containing each date (None outside the
+    # calendar's range or unparseable). Accepts anything pd.to_datetime
+    # understands.
+    table = period_table(duration_type)
+    values = pd.to_datetime(pd.Series(dates), format="mixed", errors="coerce")
+    values = values.to_numpy(dtype="datetime64[ns]")
+    starts = table["start"].to_numpy(dtype="datetime64[ns]")
+    ends = table["end"].to_numpy(dtype="datetime64[ns]")
+
+    position = np.searchsorted(starts, values, side="right") - 1
+    next_day = ends[np.clip(position, 0, None)] + np.timedelta64(1, "D")
+    inside = (position >= 0) & (values < next_day)
+    inside &= ~pd.isna(values)
+    labels = table["label"].to_numpy(dtype=object)[np.clip(position, 0, None)]
+    return pd.Series(np.where(inside, labels, None), dtype=object)
+
+
+def period_label(day, duration_type):
+    return assign_periods([day], duration_type).iloc[0]
+
+
+def recent_periods(duration_type, count, today=None):
+    # The `count` most recent periods that have started by `today`,
+    # newest first
+    today = pd.Timestamp(today or datetime.now().date())
+    table = period_table(duration_type)
+    started = table[table["start"] <= today]
+    return started["label"].iloc[::-1].head(count).tolist()
@@ -0,0 +1,268 @@
+# utils/ingest.py
+import os
+import re
+import time
+import pandas as pd
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from utils.db import get_financial_data
+from utils.fiscal_calendar import assign_periods
+from utils.periods import (
+    DURATION_TYPES,
+    WRITE_MODES,
+    build_period_document,
+    bump_data_version,
+    period_key,
+    write_filter,
+)
+from utils.peers import SKETCH_PROJECTION, update_peer_sketches
+from utils.rollups import month_start_of, update_rollups
+from utils.ratios import METRIC_KEYS, METRIC_LABELS, compute_ratios, ratio_documents
+from utils.uploads import normalize_header
+
+
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+PERIOD_COLUMNS = ["duration", "duration_type"]
+
+# Accepted header spellings (after normalization) -> field
+COLUMN_ALIASES = {
+    "period": "duration",
+    "duration": "duration",
+    "type": "duration_type",
+    "duration_type": "duration_type",
+    "period_type": "duration_type",
+    # Any date inside the period; used when there is no Period column
+    "date": "date",
+    "period_date": "date",
+}
+COLUMN_ALIASES.update({key: key for key in METRIC_KEYS})
+COLUMN_ALIASES.update(
+    {re.sub(r"\W+", "_", label.lower()): key for key, label in METRIC_LABELS.items()}
+)
+
+
+def map_columns(columns):
+    # Returns ({original header: field}, [missing fields])
+    mapping = {}
+    for column in columns:
+        field = COLUMN_ALIASES.get(normalize_header(column))
+        if field and field not in mapping.values():
+            mapping[column] = field
+    fields = set(mapping.values())
+    if "date" in fields and "duration" not in fields:
+        fields.add("duration")
+    missing = [f for f in PERIOD_COLUMNS + METRIC_KEYS if f not in fields]
+    return mapping, missing
+
+
+def read_chunks(uploaded_file, chunk_size=CHUNK_SIZE):
+    # Yields DataFrames of at most chunk_size rows without loading the whole
+    # file; .xlsx is streamed row by row through openpyxl's read-only mode
+    name = getattr(uploaded_file, "name", "")
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+        workbook.close()
+    else:
+        yield from pd.read_csv(uploaded_file, chunksize=chunk_size)
+
+
+def prepare_chunk(chunk, mapping, first_row):
+    # Validates one chunk; returns (documents' inputs, [(row, error)]).
+    # Row numbers are 1-based data rows as seen in the file (after header).
+    frame = chunk.rename(columns=mapping)
+    rows = pd.RangeIndex(first_row, first_row + len(frame))
+    frame = frame.set_axis(rows)
+
+    metrics = frame[METRIC_KEYS].apply(pd.to_numeric, errors="coerce")
+    invalid = metrics.isna()
+    errors = [
+        (row, "Missing or non-numeric: " + ", ".join(invalid.columns[invalid.loc[row]]))
+        for row in rows[invalid.any(axis=1).to_numpy()]
+    ]
+
+    duration_type = frame["duration_type"].astype(str).str.strip().str.capitalize()
+    bad_type = ~duration_type.isin(DURATION_TYPES)
+    errors += [
+        (row, f"Unknown period type '{frame.at[row, 'duration_type']}'")
+        for row in rows[bad_type.to_numpy()]
+    ]
+
+    if "duration" in frame:
+        duration = frame["duration"].astype(str).str.strip()
+    else:
+        # Map dates onto fiscal calendar periods, one vectorized pass per type
+        duration = pd.Series(None, index=rows, dtype=object)
+        for period_type in DURATION_TYPES:
+            mask = (duration_type == period_type).to_numpy()
+            if mask.any():
+                labels = assign_periods(frame.loc[mask, "date"], period_type)
+                duration[mask] = labels.to_numpy()
+        errors += [
+            (row, f"Invalid date '{frame.at[row, 'date']}'")
+            for row in rows[(duration.isna() & ~bad_type).to_numpy()]
+        ]
+
+    failed = {row for row, _ in errors}
+    valid = [row for row in rows if row not in failed]
+    prepared = pd.DataFrame(
+        {
+            "duration": duration.loc[valid],
+            "duration_type": duration_type.loc[valid],
+        }
+    ).join(metrics.loc[valid])
+    return prepared, errors
+
+
+def import_financial_data(
+    uploaded_file,
+    username,
+    mode="replace",
+    chunk_size=CHUNK_SIZE,
+    batch_size=BATCH_SIZE,
+    progress=None,
+):
+    # Streams the file, writes valid rows with unordered bulk_write batches and
+    # returns a report: rows read, inserted/replaced, per-row errors and
+    # throughput. mode is "replace" (upsert) or "reject" (existing periods are
+    # reported as errors), so re-running an import is safe.
+    # progress(rows_read) is called after every chunk.
+    if mode not in WRITE_MODES:
+        raise ValueError(f"Invalid write mode: {mode}")
+
+    collection = get_financial_data()
+    started = time.perf_counter()
+    report = {"rows": 0, "inserted": 0, "replaced": 0, "rollups": 0, "errors": []}
+    mapping = None
+    # One pending write per period key: a batch is unordered, so a period
+    # repeated in the file must not appear twice in it
+    pending = {}
+    pending_keys = {}
+    documents = {}
+    # Months written, to refresh their derived quarters/years once at the end
+    month_starts = set()
+
+    def flush():
+        if not pending:
+            return
+        rows = list(pending)
+        requests = [pending[row] for row in rows]
+        # Versions about to be replaced, to take them out of the peer
+        # sketches: one query over the period_unique index per batch
+        previous = {}
+        batch = [documents[row] for row in rows]
+        for entry in collection.find(
+            {
+                "username": username,
+                "duration_type": {"$in": list({d["duration_type"] for d in batch})},
+                "duration": {"$in": [d["duration"] for d in batch]},
+            },
+            {**SKETCH_PROJECTION, "duration": 1},
+        ):
+            previous[(entry["duration_type"], entry["duration"])] = entry
+        failed = set()
+        try:
+            result = collection.bulk_write(requests, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details.get("writeErrors", []):
+                message = error["errmsg"]
+                if error.get("code") == 11000:
+                    message = "Period already exists"
+                failed.add(rows[error["index"]])
+                report["errors"].append((rows[error["index"]], message))
+        report["inserted"] += details.get("nInserted", 0) + details.get("nUpserted", 0)
+        report["replaced"] += details.get("nMatched", 0)
+        written = [row for row in rows if row not in failed]
+        update_peer_sketches(
+            [
+                (
+                    previous.get((documents[row]["duration_type"], documents[row]["duration"])),
+                    documents[row],
+                )
+                for row in written
+            ]
+        )
+        # Only months actually written change their quarter and year
+        month_starts.update(
+            month_start_of(documents[row])
+            for row in written
+            if documents[row]["duration_type"] == "Monthly"
+        )
+        pending.clear()
+        pending_keys.clear()
+        documents.clear()
+
+    for chunk in read_chunks(uploaded_file, chunk_size):
+        if mapping is None:
+            mapping, missing = map_columns(chunk.columns)
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        prepared, errors = prepare_chunk(chunk, mapping, report["rows"] + 1)
+        report["rows"] += len(chunk)
+        report["errors"].extend(errors)
+
+        # Ratios for the whole chunk in one vectorized pass
+        ratios = ratio_documents(compute_ratios(prepared)) if len(prepared) else []
+        metric_rows = prepared[METRIC_KEYS].to_dict("records")
+        for row, duration, duration_type, metrics, stored in zip(
+            prepared.index,
+            prepared["duration"],
+            prepared["duration_type"],
+            metric_rows,
+            ratios,
+        ):
+            try:
+                document = build_period_document(
+                    username, duration, duration_type, metrics, ratios=stored
+                )
+            except ValueError as e:
+                report["errors"].append((row, f"Invalid period '{duration}': {e}"))
+                continue
+            key = tuple(period_key(document).values())
+            if key in pending_keys:
+                earlier = pending_keys[key]
+                if mode == "reject":
+                    report["errors"].append((row, f"Duplicate of row {earlier}"))
+                    continue
+                del pending[earlier]
+                del documents[earlier]
+                report["errors"].append((earlier, f"Replaced by row {row}"))
+            pending_keys[key] = row
+            documents[row] = document
+            # In reject mode only a derived rollup can be replaced; an
+            # existing manual period fails with a duplicate key error
+            pending[row] = ReplaceOne(write_filter(document, mode), document, upsert=True)
+            if len(pending) == batch_size:
+                flush()
+
+        if progress is not None:
+            progress(report["rows"])
+
+    flush()
+    if month_starts:
+        report["rollups"] = update_rollups(username, month_starts)
+    if report["inserted"] or report["replaced"]:
+        bump_data_version(username)
+
+    report["errors"].sort()
+    report["seconds"] = time.perf_counter() - started
+    report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0
+    return report
@@ -0,0 +1,80 @@
+# utils/passwords.py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bcrypt
+import streamlit as st
+
+
+# bcrypt work factor for new hashes; stored hashes with another cost are
+# rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Concurrent hash/verify operations per process. bcrypt releases the GIL, so
+# the pool bounds CPU use during a login burst while script threads only wait.
+PASSWORD_WORKERS = int(
+    os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+# Worker processes for bulk hashing (user provisioning)
+PASSWORD_PROCESSES = int(os.getenv("PASSWORD_PROCESSES", str(os.cpu_count() or 1)))
+
+
+@st.cache_resource
+def get_executor():
+    # One pool per process, shared by every session
+    return ThreadPoolExecutor(
+        max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt"
+    )
+
+
+@st.cache_resource
+def get_process_pool():
+    # spawn: forking the multi-threaded server process is not safe
+    return ProcessPoolExecutor(
+        max_workers=PASSWORD_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(rounds)
+    ).decode("utf-8")
+
+
+def _verify(password, hashed):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def hash_password(password, rounds=None):
+    return get_executor().submit(_hash, password, rounds or BCRYPT_ROUNDS).result()
+
+
+def hash_passwords(passwords, rounds=None, progress=None, chunk_size=50):
+    # Hashes many passwords across the process pool, in input order.
+    # progress(hashed, total) is called after every chunk.
+    rounds = rounds or BCRYPT_ROUNDS
+    pool = get_process_pool()
+    hashed = []
+    for start in range(0, len(passwords), chunk_size):
+        chunk = passwords[start : start + chunk_size]
+        hashed.extend(pool.map(_hash, chunk, [rounds] * len(chunk)))
+        if progress is not None:
+            progress(len(hashed), len(passwords))
+    return hashed
+
+
+def verify_password(password, hashed):
+    return get_executor().submit(_verify, password, hashed).result()
+
+
+def hash_cost(hashed):
+    # "$2b$12$..." -> 12
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    return hash_cost(hashed) != BCRYPT_ROUNDS
@@ -0,0 +1,188 @@
+# utils/peers.py
+import math
+import os
+from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
+import streamlit as st
+from pymongo import UpdateOne
+from utils.db import get_db
+from utils.ratios import RATIO_FIELDS, RATIOS_VERSION
+
+
+# Per (period type, ratio) quantile sketches of every stored period, kept up
+# to date on each write, so peer percentiles never need a scan of
+# financial_data.
+#
+# A sketch is a log-bucketed histogram (as in DDSketch): a value v > 0 falls
+# in bucket ceil(log_gamma(v)), negatives mirror that, and values near zero
+# share one bucket. Every bucket spans at most SKETCH_RELATIVE_ACCURACY of
+# its values, the counts are plain integers updated with $inc (atomic, and
+# the order of concurrent writes does not matter) and a period that is
+# overwritten is taken out of its old buckets again.
+SKETCH_COLLECTION = "ratio_sketches"
+
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.01"))
+GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+
+# |v| below this counts as zero
+ZERO_THRESHOLD = 1e-9
+
+# Sketches are a few KB; a page view reads them at most this often
+SKETCH_CACHE_SECONDS = int(os.getenv("SKETCH_CACHE_SECONDS", "60"))
+
+# Fields read from a previous document to take it out of the sketches
+SKETCH_PROJECTION = {"duration_type": 1, "ratios": 1, "ratios_version": 1, "complete": 1}
+
+
+def get_sketches():
+    return get_db()[SKETCH_COLLECTION]
+
+
+def bucket_key(value):
+    # Field-name-safe bucket id: "z", "p<k>" or "n<k>"
+    if abs(value) < ZERO_THRESHOLD:
+        return "z"
+    index = math.ceil(math.log(abs(value), GAMMA))
+    return f"{'p' if value > 0 else 'n'}{index}"
+
+
+def bucket_value(key):
+    # Representative value of a bucket (its relative midpoint)
+    if key == "z":
+        return 0.0
+    value = 2 * GAMMA ** int(key[1:]) / (GAMMA + 1)
+    return value if key[0] == "p" else -value
+
+
+def _contribution(document):
+    # Ratios a stored period adds to the sketches: current stored ratios of
+    # anything but a partial derived quarter/year
+    if (
+        document is None
+        or document.get("ratios_version") != RATIOS_VERSION
+        or document.get("complete") is False
+    ):
+        return None
+    return document["ratios"]
+
+
+def sketch_deltas(changes):
+    # changes: [(previous document or None, new document or None)]
+    # -> {(duration_type, field): Counter(bucket -> count delta)}
+    deltas = defaultdict(Counter)
+    for previous, document in changes:
+        for sign, entry in ((-1, previous), (1, document)):
+            ratios = _contribution(entry)
+            if ratios is None:
+                continue
+            for field, value in ratios.items():
+                if value is not None and math.isfinite(value):
+                    deltas[(entry["duration_type"], field)][bucket_key(value)] += sign
+    return deltas
+
+
+def update_peer_sketches(changes):
+    # Applies the writes in `changes` to the sketches: one unordered
+    # bulk_write of $inc updates, however many periods changed
+    requests = []
+    for (duration_type, field), counts in sketch_deltas(changes).items():
+        inc = {f"counts.{key}": delta for key, delta in counts.items() if delta}
+        if not inc:
+            continue
+        inc["total"] = sum(counts.values())
+        requests.append(
+            UpdateOne(
+                {"_id": f"{duration_type}:{field}"},
+                {
+                    "$inc": inc,
+                    "$set": {
+                        "duration_type": duration_type,
+                        "field": field,
+                        "ratios_version": RATIOS_VERSION,
+                    },
+                },
+                upsert=True,
+            )
+        )
+    if requests:
+        get_sketches().bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+@st.cache_data(ttl=SKETCH_CACHE_SECONDS, show_spinner=False)
+def load_sketches(duration_type):
+    # {field: (bucket values ascending, cumulative counts)} for one period
+    # type; one small document per ratio
+    sketches = {}
+    for sketch in get_sketches().find(
+        {"duration_type": duration_type, "ratios_version": RATIOS_VERSION}
+    ):
+        counts = {key: count for key, count in sketch["counts"].items() if count > 0}
+        if not counts:
+            continue
+        values = np.array([bucket_value(key) for key in counts])
+        order = np.argsort(values)
+        sketches[sketch["field"]] = (
+            values[order],
+            np.cumsum(np.array(list(counts.values()))[order]),
+        )
+    return sketches
+
+
+def percentile_rank(sketch, value):
+    # Share of peers below `value` (half of its own bucket), 0-100
+    values, cumulative = sketch
+    bucket = bucket_value(bucket_key(value))
+    position = np.searchsorted(values, bucket)
+    below = cumulative[position - 1] if position > 0 else 0
+    same = 0
+    if position < len(values) and values[position] == bucket:
+        same = cumulative[position] - below
+    return 100 * (below + same / 2) / cumulative[-1]
+
+
+def peer_percentiles(ratios, duration_type):
+    # ratios: Series by ratio name -> DataFrame (Ratio, Value, Percentile,
+    # Peers); Percentile is NaN without peers or value
+    sketches = load_sketches(duration_type)
+    rows = []
+    for name, value in ratios.items():
+        sketch = sketches.get(RATIO_FIELDS[name])
+        valid = sketch is not None and value is not None and np.isfinite(value)
+        rows.append(
+            {
+                "Ratio": name,
+                "Value": value,
+                "Percentile": percentile_rank(sketch, value) if valid else np.nan,
+                "Peers": int(sketch[1][-1]) if sketch is not None else 0,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def rebuild_sketches(collection, batch_size=1000):
+    # Recounts every sketch from financial_data (init_db.py build-sketches):
+    # for existing data, and after backfill-ratios changes stored ratios
+    deltas = defaultdict(Counter)
+    cursor = collection.find({}, SKETCH_PROJECTION, batch_size=batch_size)
+    for document in cursor:
+        for key, counts in sketch_deltas([(None, document)]).items():
+            deltas[key].update(counts)
+
+    sketches = get_sketches()
+    sketches.delete_many({})
+    documents = [
+        {
+            "_id": f"{duration_type}:{field}",
+            "duration_type": duration_type,
+            "field": field,
+            "ratios_version": RATIOS_VERSION,
+            "counts": dict(counts),
+            "total": sum(counts.values()),
+        }
+        for (duration_type, field), counts in deltas.items()
+    ]
+    if documents:
+        sketches.insert_many(documents)
+    return len(documents)
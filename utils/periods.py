@@ -0,0 +1,267 @@
+# utils/periods.py
+import streamlit as st
+import os
+import pandas as pd
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, time
+from utils.db import get_financial_data, get_users
+from utils.peers import SKETCH_PROJECTION, update_peer_sketches
+from utils.fiscal_calendar import period_label, period_range, recent_periods
+from utils.ratios import METRIC_KEYS, METRIC_LABELS, RATIOS_VERSION, materialize_ratios
+
+
+# Fields the history table and the period preview read
+PERIOD_PROJECTION = {
+    "duration": 1,
+    "duration_type": 1,
+    "start_date": 1,
+    "end_date": 1,
+    "period_index": 1,
+    "data": 1,
+    "ratios": 1,
+    "ratios_version": 1,
+    "derived": 1,
+    "complete": 1,
+    "source_months": 1,
+}
+
+DURATION_TYPES = ("Monthly", "Quarterly", "Annually")
+
+DEFAULT_PAGE_SIZE = int(os.getenv("PERIOD_PAGE_SIZE", "24"))
+
+# Pages kept in the process-wide cache, shared by all sessions (LRU)
+CACHE_MAX_ENTRIES = int(os.getenv("PERIOD_CACHE_MAX_ENTRIES", "256"))
+
+
+def fiscal_year_label(day):
+    # e.g. Jan 2024 -> "FY 2023-24" (April fiscal year start)
+    return period_label(day, "Annually")
+
+
+def quarter_label(day):
+    # e.g. Oct 2023 -> "FY 2023-24 Q4"
+    return period_label(day, "Quarterly")
+
+
+# Number of periods offered when adding data by hand
+OPTION_COUNTS = {"Monthly": 12, "Quarterly": 4, "Annually": 5}
+
+
+def generate_options(duration_type):
+    # Most recent periods first, straight from the fiscal calendar tables
+    return recent_periods(duration_type, OPTION_COUNTS[duration_type])
+
+
+def generate_date_range(duration, duration_type):
+    if duration_type not in DURATION_TYPES:
+        raise ValueError("Invalid duration type")
+    return period_range(duration, duration_type)
+
+
+def to_datetime(day):
+    # BSON has no date-only type
+    return datetime.combine(day, time.min)
+
+
+def period_index(day):
+    return day.year * 100 + day.month
+
+
+def build_period_document(username, duration, duration_type, metrics, ratios=None):
+    # ratios: precomputed stored ratios (bulk imports compute them per batch)
+    start_date, end_date = generate_date_range(duration, duration_type)
+    data = {
+        "username": username,
+        "duration": duration,  # e.g., "Jan 2024" or "FY 2023-24 Q4"
+        "duration_type": duration_type,  # "Monthly", "Quarterly", or "Annually"
+        # Native dates for display and paging; period_index (yyyymm of the
+        # start) keys the range and last-N queries of find_periods
+        "start_date": to_datetime(start_date),
+        "end_date": to_datetime(end_date),
+        "period_index": period_index(start_date),
+        "data": {key: metrics[key] for key in METRIC_KEYS},
+    }
+    # Store the ratios with the metrics so read paths can use them directly
+    data["ratios"] = materialize_ratios(data["data"]) if ratios is None else ratios
+    data["ratios_version"] = RATIOS_VERSION
+    return data
+
+
+# What to do when a period (username, duration_type, duration) already exists
+WRITE_MODES = {
+    "replace": "Replace the existing data",
+    "reject": "Keep the existing data",
+}
+
+
+def period_key(document):
+    return {
+        "username": document["username"],
+        "duration_type": document["duration_type"],
+        "duration": document["duration"],
+    }
+
+
+def write_filter(document, mode):
+    # What a write may replace: any existing version of the period in
+    # "replace" mode, only a derived rollup (utils/rollups.py) in "reject"
+    # mode, so figures entered by hand always win over derived ones
+    if mode == "reject":
+        return {**period_key(document), "derived": True}
+    return period_key(document)
+
+
+def write_period(document, mode="replace"):
+    # Idempotent save against the unique (username, duration_type, duration)
+    # index; returns (written, message)
+    collection = get_financial_data()
+    if mode not in WRITE_MODES:
+        raise ValueError(f"Invalid write mode: {mode}")
+    # A replacement must not carry an _id of its own
+    replacement = {k: v for k, v in document.items() if k != "_id"}
+    key = write_filter(document, mode)
+    try:
+        # The previous version comes back with the write, for the peer sketches
+        previous = collection.find_one_and_replace(
+            key, replacement, SKETCH_PROJECTION, upsert=True
+        )
+    except DuplicateKeyError:
+        # reject mode: a period entered by hand already holds the key
+        return False, f"{document['duration']} already exists"
+
+    update_peer_sketches([(previous, document)])
+    bump_data_version(document["username"])
+    if previous is None:
+        return True, "Data saved successfully"
+    if mode == "reject":
+        # Only a derived rollup can have been replaced (write_filter)
+        return True, (
+            f"{document['duration']} was derived from monthly data; "
+            "replaced it with the entered figures"
+        )
+    return True, "Data replaced successfully"
+
+
+def get_data_version(username):
+    # Counter on the user document, bumped on every write to their periods
+    user = get_users().find_one({"username": username}, {"data_version": 1})
+    return (user or {}).get("data_version", 0)
+
+
+def bump_data_version(username):
+    get_users().update_one({"username": username}, {"$inc": {"data_version": 1}})
+
+
+def fetch_period_page(username, after=None, page_size=DEFAULT_PAGE_SIZE):
+    # Keyset pagination, newest first, over the (username, start_date, _id)
+    # index. `after` is the (start_date, _id) of the last row already shown.
+    query = {"username": username}
+    if after is not None:
+        start_date, last_id = after
+        query["$or"] = [
+            {"start_date": {"$lt": start_date}},
+            {"start_date": start_date, "_id": {"$lt": ObjectId(last_id)}},
+        ]
+
+    docs = list(
+        get_financial_data()
+        .find(query, PERIOD_PROJECTION)
+        .sort([("start_date", -1), ("_id", -1)])
+        .limit(page_size + 1)
+    )
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+    # _id as a string keeps the cursor hashable for st.cache_data
+    next_after = (docs[-1]["start_date"], str(docs[-1]["_id"])) if docs else after
+    return docs, next_after, has_more
+
+
+def find_periods(
+    username,
+    duration_type=None,
+    start=None,
+    end=None,
+    last=None,
+    projection=PERIOD_PROJECTION,
+    complete_only=False,
+):
+    # A user's periods, oldest first, whose start falls in [start, end]
+    # (dates or datetimes) and/or only the `last` N of them. Served by the
+    # (username, duration_type, period_index) index when duration_type is set.
+    # complete_only leaves out partial derived quarters/years (utils/rollups.py).
+    query = {"username": username}
+    if duration_type is not None:
+        query["duration_type"] = duration_type
+    if complete_only:
+        query["complete"] = {"$ne": False}
+    if start is not None or end is not None:
+        query["period_index"] = {}
+        if start is not None:
+            query["period_index"]["$gte"] = _first_index_from(start)
+        if end is not None:
+            query["period_index"]["$lte"] = period_index(end)
+
+    cursor = get_financial_data().find(query, projection)
+    if last is None:
+        return list(cursor.sort("period_index", 1))
+    return list(cursor.sort("period_index", -1).limit(last))[::-1]
+
+
+def find_periods_in(
+    username, duration, duration_type, include_type=None, projection=PERIOD_PROJECTION
+):
+    # Everything starting inside a labelled period, e.g. all months of
+    # "FY 2023-24": find_periods_in(user, "FY 2023-24", "Annually", "Monthly")
+    start, end = generate_date_range(duration, duration_type)
+    return find_periods(username, include_type, start=start, end=end, projection=projection)
+
+
+def _first_index_from(day):
+    # Periods start on the 1st of a month: the first one starting on or after
+    # `day` is in the next month unless `day` is a 1st (yyyy12 + 89 = yyyy+1 01)
+    index = period_index(day)
+    if day.day > 1:
+        index += 89 if day.month == 12 else 1
+    return index
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_period_page(username, data_version, after=None, page_size=DEFAULT_PAGE_SIZE):
+    # Read-through cache: data_version is part of the key, so a write (which
+    # bumps it) makes every cached page of that user unreachable
+    return fetch_period_page(username, after, page_size)
+
+
+def process_financial_data(data_list):
+    # History table: one row per period, metric columns kept as float64 so
+    # they sort numerically (format at display time). Derived marks rollups
+    # of monthly data (utils/rollups.py); Complete is False for a derived
+    # quarter/year that is missing some of its months.
+    columns = ["Period", "Type", "Date Range", "Derived", "Complete"] + list(
+        METRIC_LABELS.values()
+    )
+    if not data_list:
+        return pd.DataFrame(columns=columns)
+
+    periods = pd.DataFrame.from_records(
+        data_list,
+        columns=["duration", "duration_type", "start_date", "end_date", "derived", "complete"],
+    )
+    metrics = pd.DataFrame.from_records(
+        [entry["data"] for entry in data_list], columns=METRIC_KEYS
+    ).astype("float64")
+
+    df = pd.DataFrame(
+        {
+            "Period": periods["duration"],
+            "Type": periods["duration_type"],
+            "Date Range": pd.to_datetime(periods["start_date"]).dt.strftime("%Y-%m-%d")
+            + " to "
+            + pd.to_datetime(periods["end_date"]).dt.strftime("%Y-%m-%d"),
+            # Missing on periods entered by hand
+            "Derived": periods["derived"].eq(True),
+            "Complete": periods["complete"].ne(False),
+        }
+    )
+    return pd.concat([df, metrics.rename(columns=METRIC_LABELS)], axis=1)[columns]
@@ -0,0 +1,195 @@
+# utils/portfolio.py
+import os
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.db import get_financial_data
+from utils.ratios import RATIO_FIELDS, RATIO_NAMES, RATIOS_VERSION
+
+
+# Portfolio figures are shared by all admins and refreshed at most this often
+PORTFOLIO_CACHE_SECONDS = int(os.getenv("PORTFOLIO_CACHE_SECONDS", "300"))
+
+# Histogram bins between the outlier fences
+DISTRIBUTION_BINS = 20
+
+# Tukey fences: outside [Q1 - k * IQR, Q3 + k * IQR] is an outlier
+OUTLIER_IQR_FACTOR = 1.5
+
+OUTLIER_LIMIT = 20
+
+
+def _field(name):
+    return f"$ratios.{RATIO_FIELDS[name]}"
+
+
+def portfolio_scope(duration_type, duration=None):
+    # Pipeline stages selecting one period per user: the given period, or
+    # each user's latest period of the type. Only current stored ratios are
+    # read (run `init_db.py backfill-ratios` after a formula change) and
+    # partial derived quarters/years are left out.
+    match = {
+        "duration_type": duration_type,
+        "ratios_version": RATIOS_VERSION,
+        "complete": {"$ne": False},
+    }
+    if duration is not None:
+        # At most one document per user (period_unique index)
+        return [{"$match": {**match, "duration": duration}}]
+    return [
+        {"$match": match},
+        {"$sort": {"username": 1, "start_date": -1}},
+        {
+            "$group": {
+                "_id": "$username",
+                "username": {"$first": "$username"},
+                "duration": {"$first": "$duration"},
+                "ratios": {"$first": "$ratios"},
+            }
+        },
+    ]
+
+
+def _is_number(name):
+    return {"$isNumber": _field(name)}
+
+
+def _summary_pipeline(scope):
+    # $percentile needs MongoDB 7.0 or later
+    group = {"_id": None, "users": {"$sum": 1}}
+    for i, name in enumerate(RATIO_NAMES):
+        group[f"count_{i}"] = {"$sum": {"$cond": [_is_number(name), 1, 0]}}
+        group[f"mean_{i}"] = {"$avg": _field(name)}
+        group[f"min_{i}"] = {"$min": _field(name)}
+        group[f"max_{i}"] = {"$max": _field(name)}
+        group[f"quartiles_{i}"] = {
+            "$percentile": {
+                "input": _field(name),
+                "p": [0.25, 0.5, 0.75],
+                "method": "approximate",
+            }
+        }
+    return scope + [{"$group": group}]
+
+
+def _fences(row):
+    spread = OUTLIER_IQR_FACTOR * (row["Q3"] - row["Q1"])
+    return row["Q1"] - spread, row["Q3"] + spread
+
+
+def _outside(name, low, high):
+    value = _field(name)
+    return {
+        "$and": [
+            _is_number(name),
+            {"$or": [{"$lt": [value, low]}, {"$gt": [value, high]}]},
+        ]
+    }
+
+
+@st.cache_data(ttl=PORTFOLIO_CACHE_SECONDS, show_spinner=False)
+def portfolio_summary(duration_type, duration=None):
+    # Per ratio across users: count, mean, quartiles, range and the number
+    # of outliers. Two aggregations ($group), a few KB back to the app.
+    collection = get_financial_data()
+    scope = portfolio_scope(duration_type, duration)
+    result = next(collection.aggregate(_summary_pipeline(scope)), None)
+    if result is None:
+        return pd.DataFrame(), 0
+
+    rows = []
+    for i, name in enumerate(RATIO_NAMES):
+        quartiles = result[f"quartiles_{i}"] or [None] * 3
+        rows.append(
+            {
+                "Ratio": name,
+                "Users": result[f"count_{i}"],
+                "Mean": result[f"mean_{i}"],
+                "Q1": quartiles[0],
+                "Median": quartiles[1],
+                "Q3": quartiles[2],
+                "Min": result[f"min_{i}"],
+                "Max": result[f"max_{i}"],
+            }
+        )
+    summary = pd.DataFrame(rows).set_index("Ratio").astype("float64")
+    summary["Users"] = summary["Users"].astype("int64")
+
+    # Outliers per ratio, counted server-side against the fences
+    group = {"_id": None}
+    for i, name in enumerate(RATIO_NAMES):
+        low, high = _fences(summary.loc[name])
+        if np.isnan(low):
+            continue
+        group[f"outliers_{i}"] = {"$sum": {"$cond": [_outside(name, low, high), 1, 0]}}
+    counts = next(collection.aggregate(scope + [{"$group": group}]), {})
+    summary["Outliers"] = [counts.get(f"outliers_{i}", 0) for i in range(len(RATIO_NAMES))]
+    return summary, result["users"]
+
+
+@st.cache_data(ttl=PORTFOLIO_CACHE_SECONDS, show_spinner=False)
+def ratio_distribution(duration_type, name, low, high, duration=None):
+    # Histogram of one ratio between the outlier fences ($bucket); values
+    # outside them are counted in a single "Outliers" bucket
+    edges = np.linspace(low, high, DISTRIBUTION_BINS + 1)
+    # Boundaries are [lower, upper): keep a value equal to `high` inside
+    edges[-1] = np.nextafter(high, np.inf)
+    pipeline = portfolio_scope(duration_type, duration) + [
+        {"$match": {f"ratios.{RATIO_FIELDS[name]}": {"$type": "number"}}},
+        {
+            "$bucket": {
+                "groupBy": _field(name),
+                "boundaries": edges.tolist(),
+                "default": "Outliers",
+                "output": {"users": {"$sum": 1}},
+            }
+        },
+    ]
+    buckets = list(get_financial_data().aggregate(pipeline))
+    counts = {bucket["_id"]: bucket["users"] for bucket in buckets}
+    distribution = pd.DataFrame(
+        {
+            "From": edges[:-1],
+            "To": edges[1:],
+            "Users": [counts.get(edge, 0) for edge in edges[:-1].tolist()],
+        }
+    )
+    return distribution, counts.get("Outliers", 0)
+
+
+@st.cache_data(ttl=PORTFOLIO_CACHE_SECONDS, show_spinner=False)
+def ratio_outliers(duration_type, name, low, high, duration=None, limit=OUTLIER_LIMIT):
+    # The most extreme users outside the fences, furthest from the median
+    # range first
+    value = _field(name)
+    pipeline = portfolio_scope(duration_type, duration) + [
+        {"$match": {"$expr": _outside(name, low, high)}},
+        {
+            "$project": {
+                "_id": 0,
+                "username": 1,
+                "duration": 1,
+                "value": value,
+                "distance": {
+                    "$max": [{"$subtract": [low, value]}, {"$subtract": [value, high]}]
+                },
+            }
+        },
+        {"$sort": {"distance": -1}},
+        {"$limit": limit},
+    ]
+    outliers = pd.DataFrame(
+        list(get_financial_data().aggregate(pipeline)),
+        columns=["username", "duration", "value"],
+    )
+    return outliers.rename(columns={"username": "User", "duration": "Period", "value": name})
+
+
+def outlier_fences(summary, name):
+    return _fences(summary.loc[name])
+
+
+def distribution_range(summary, name):
+    # The fences narrowed to the observed values
+    low, high = outlier_fences(summary, name)
+    return max(low, summary.at[name, "Min"]), min(high, summary.at[name, "Max"])
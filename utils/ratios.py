@@ -0,0 +1,315 @@
+# utils/ratios.py
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+
+METRIC_KEYS = [
+    # Income Statement Metrics
+    "revenue",
+    "operating_profit",
+    "ebit",
+    "cogs",
+    "net_profit",
+    "interest_expense",
+    "pbit",
+    # Balance Sheet Metrics
+    "total_assets",
+    "current_assets",
+    "liquid_current_assets",
+    "cash",
+    "average_inventory",
+    "total_equity",
+    "current_liabilities",
+    "cash_equivalents",
+    "average_accounts_receivable",
+    "average_accounts_payable",
+    "total_debt",
+    "shareholders_equity",
+    "capital_employed",
+    "average_assets",
+    "average_total_assets",
+    # Sales Metrics
+    "net_sales",
+    "net_credit_sales",
+    "net_annual_sales",
+    "net_credit_purchases",
+    "average_working_capital",
+]
+
+# Display names for the metrics, e.g. "average_total_assets" -> "Average Total Assets"
+METRIC_LABELS = {
+    key: " ".join(word.capitalize() for word in key.split("_")) for key in METRIC_KEYS
+}
+
+
+def safe_divide(numerator, denominator):
+    # A zero denominator yields 0 (what the dashboards have always shown),
+    # a missing (NaN) input on either side yields NaN.
+    numerator = np.asarray(numerator, dtype="float64")
+    denominator = np.asarray(denominator, dtype="float64")
+    result = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return np.where(np.isnan(numerator) | np.isnan(denominator), np.nan, result)
+
+
+# Ratio registry: every ratio declares its group, the metrics it reads and a
+# vectorized formula taking those metrics (as arrays) in the declared order.
+RATIOS = {}
+
+
+def register_ratio(name, group, inputs, formula):
+    RATIOS[name] = {"group": group, "inputs": tuple(inputs), "formula": formula}
+
+
+# Profitability Ratios (percentages)
+register_ratio(
+    "Gross Profit Margin",
+    "Profitability Ratios",
+    ["revenue", "cogs"],
+    lambda revenue, cogs: safe_divide(revenue - cogs, revenue) * 100,
+)
+register_ratio(
+    "Operating Profit Margin",
+    "Profitability Ratios",
+    ["operating_profit", "revenue"],
+    lambda operating_profit, revenue: safe_divide(operating_profit, revenue) * 100,
+)
+register_ratio(
+    "Net Profit Margin",
+    "Profitability Ratios",
+    ["net_profit", "revenue"],
+    lambda net_profit, revenue: safe_divide(net_profit, revenue) * 100,
+)
+register_ratio(
+    "Return on Assets",
+    "Profitability Ratios",
+    ["net_profit", "average_assets"],
+    lambda net_profit, average_assets: safe_divide(net_profit, average_assets) * 100,
+)
+register_ratio(
+    "Return on Capital Employed",
+    "Profitability Ratios",
+    ["pbit", "capital_employed"],
+    lambda pbit, capital_employed: safe_divide(pbit, capital_employed) * 100,
+)
+register_ratio(
+    "Return on Equity",
+    "Profitability Ratios",
+    ["net_profit", "shareholders_equity"],
+    lambda net_profit, shareholders_equity: (
+        safe_divide(net_profit, shareholders_equity) * 100
+    ),
+)
+
+# Liquidity Ratios
+register_ratio(
+    "Current Ratio",
+    "Liquidity Ratios",
+    ["current_assets", "current_liabilities"],
+    safe_divide,
+)
+register_ratio(
+    "Quick Ratio",
+    "Liquidity Ratios",
+    ["liquid_current_assets", "current_liabilities"],
+    safe_divide,
+)
+register_ratio(
+    "Cash Ratio",
+    "Liquidity Ratios",
+    ["cash", "cash_equivalents", "current_liabilities"],
+    lambda cash, cash_equivalents, current_liabilities: safe_divide(
+        cash + cash_equivalents, current_liabilities
+    ),
+)
+
+# Efficiency Ratios
+register_ratio(
+    "Accounts Receivable Turnover",
+    "Efficiency Ratios",
+    ["net_credit_sales", "average_accounts_receivable"],
+    safe_divide,
+)
+register_ratio(
+    "Accounts Payable Turnover",
+    "Efficiency Ratios",
+    ["net_credit_purchases", "average_accounts_payable"],
+    safe_divide,
+)
+register_ratio(
+    "Assets Turnover",
+    "Efficiency Ratios",
+    ["net_sales", "average_total_assets"],
+    safe_divide,
+)
+register_ratio(
+    "Capital Turnover",
+    "Efficiency Ratios",
+    ["net_sales", "capital_employed"],
+    safe_divide,
+)
+register_ratio(
+    "Inventory Turnover",
+    "Efficiency Ratios",
+    ["cogs", "average_inventory"],
+    safe_divide,
+)
+register_ratio(
+    "Working Capital Turnover",
+    "Efficiency Ratios",
+    ["net_annual_sales", "average_working_capital"],
+    safe_divide,
+)
+
+# Solvency Ratios
+register_ratio(
+    "Debt Ratio", "Solvency Ratios", ["total_debt", "total_assets"], safe_divide
+)
+register_ratio(
+    "Equity Ratio", "Solvency Ratios", ["total_equity", "total_assets"], safe_divide
+)
+register_ratio(
+    "Debt to Equity", "Solvency Ratios", ["total_debt", "total_equity"], safe_divide
+)
+register_ratio(
+    "Interest Coverage", "Solvency Ratios", ["ebit", "interest_expense"], safe_divide
+)
+
+RATIO_NAMES = list(RATIOS)
+
+# Bump whenever a formula changes so stored ratios get recomputed
+# (python init_db.py backfill-ratios).
+RATIOS_VERSION = 1
+
+# Field names used when ratios are stored in MongoDB, e.g. "debt_to_equity"
+RATIO_FIELDS = {name: name.lower().replace(" ", "_") for name in RATIO_NAMES}
+
+RATIO_GROUPS = {}
+for _name, _spec in RATIOS.items():
+    RATIO_GROUPS.setdefault(_spec["group"], []).append(_name)
+
+# Dependency graph: metric -> ratios that read it
+METRIC_DEPENDENTS = {key: [] for key in METRIC_KEYS}
+for _name, _spec in RATIOS.items():
+    for _key in _spec["inputs"]:
+        METRIC_DEPENDENTS[_key].append(_name)
+
+
+def dependent_ratios(changed_metrics):
+    names = set()
+    for key in changed_metrics:
+        names.update(METRIC_DEPENDENTS.get(key, []))
+    return [name for name in RATIO_NAMES if name in names]
+
+
+def metrics_frame(batch, keys=METRIC_KEYS):
+    # Accepts a DataFrame, a mapping of metric -> scalar/array, or a list of
+    # metric dicts, and returns one float64 row per period.
+    if isinstance(batch, pd.DataFrame):
+        frame = batch
+    elif isinstance(batch, Mapping):
+        frame = pd.DataFrame({key: np.atleast_1d(value) for key, value in batch.items()})
+    else:
+        frame = pd.DataFrame(list(batch))
+
+    missing = [key for key in keys if key not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing financial metrics: {', '.join(missing)}")
+
+    return frame[list(keys)].astype("float64")
+
+
+def compute_ratios(batch, names=None):
+    names = RATIO_NAMES if names is None else list(names)
+    keys = [key for key in METRIC_KEYS if any(key in RATIOS[n]["inputs"] for n in names)]
+    frame = metrics_frame(batch, keys)
+    columns = {key: frame[key].to_numpy() for key in keys}
+
+    ratios = {}
+    for name in names:
+        spec = RATIOS[name]
+        ratios[name] = spec["formula"](*(columns[key] for key in spec["inputs"]))
+
+    return pd.DataFrame(ratios, index=frame.index, columns=names)
+
+
+def update_ratios(previous_metrics, previous_ratios, metrics):
+    # Recompute only the ratios whose inputs changed; returns the new ratio
+    # Series and the names of ratios whose value actually moved.
+    changed_metrics = [
+        key for key in METRIC_KEYS if metrics.get(key) != previous_metrics.get(key)
+    ]
+    names = dependent_ratios(changed_metrics)
+    ratios = previous_ratios.copy()
+    if not names:
+        return ratios, set()
+
+    fresh = compute_ratios(metrics, names).iloc[0]
+    changed = changed_ratios(ratios, fresh, names)
+    ratios[names] = fresh[names]
+    return ratios, changed
+
+
+def changed_ratios(previous_ratios, ratios, names=RATIO_NAMES):
+    return {
+        name
+        for name in names
+        if not (pd.isna(ratios[name]) and pd.isna(previous_ratios[name]))
+        and ratios[name] != previous_ratios[name]
+    }
+
+
+def ratio_documents(frame):
+    # Stored form of computed ratios: one {field: value} dict per row, with
+    # NaN written as None so it round-trips through MongoDB.
+    stored = frame[RATIO_NAMES].rename(columns=RATIO_FIELDS).astype(object)
+    stored = stored.where(stored.notna(), None)
+    return stored.to_dict("records")
+
+
+def materialize_ratios(metrics):
+    return ratio_documents(compute_ratios(metrics))[0]
+
+
+def stored_ratios(entry):
+    # Ratios persisted on the document, or None when missing or computed by
+    # an older formula version.
+    if entry.get("ratios_version") != RATIOS_VERSION or "ratios" not in entry:
+        return None
+    stored = entry["ratios"]
+    return pd.Series(
+        {name: stored.get(field) for name, field in RATIO_FIELDS.items()},
+        dtype="float64",
+    )
+
+
+def compute_history_ratios(data_list):
+    # Ratios for every stored period of a user; precomputed ratios are used
+    # as-is and only stale documents are computed, in one pass.
+    if not data_list:
+        return pd.DataFrame(columns=["Period", "Type"] + RATIO_NAMES)
+
+    fresh = [
+        i
+        for i, entry in enumerate(data_list)
+        if entry.get("ratios_version") == RATIOS_VERSION and "ratios" in entry
+    ]
+    stale = sorted(set(range(len(data_list))) - set(fresh))
+
+    # Stored ratios in one frame construction; a stored None reads back as NaN
+    ratios = pd.DataFrame.from_records(
+        [data_list[i]["ratios"] for i in fresh],
+        columns=list(RATIO_FIELDS.values()),
+    ).set_axis(fresh).rename(columns={field: name for name, field in RATIO_FIELDS.items()})
+    ratios = ratios.astype("float64")
+    if stale:
+        computed = compute_ratios([data_list[i]["data"] for i in stale])[RATIO_NAMES]
+        computed = computed.astype("float64").set_axis(stale)
+        ratios = pd.concat([ratios, computed]) if fresh else computed
+        ratios = ratios.sort_index()
+
+    ratios.insert(0, "Type", [entry["duration_type"] for entry in data_list])
+    ratios.insert(0, "Period", [entry["duration"] for entry in data_list])
+    return ratios
@@ -1,224 +1,312 @@
 import streamlit as st
+import math
+import os
+from functools import lru_cache
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+from pymongo.errors import PyMongoError
+from utils.peers import peer_percentiles
+from utils.ratios import (
+    RATIO_GROUPS,
+    changed_ratios,
+    compute_history_ratios,
+    compute_ratios,
+    stored_ratios,
+    update_ratios,
+)
 
 
 def format_number(value):
     return "{:,.2f}".format(value)
 
 
-def create_gauge_chart(value, title, min_val=0, max_val=100):
+# Figures kept per process, keyed by the values they show
+FIGURE_CACHE_SIZE = int(os.getenv("FIGURE_CACHE_SIZE", "512"))
+
+# The three headline gauges: (ratio, title, scale, max_val)
+GAUGES = [
+    ("Net Profit Margin", "Net Profit Margin (%)", 1, 100),
+    ("Current Ratio", "Current Ratio", 100, 300),
+    ("Debt to Equity", "Debt to Equity Ratio", 100, 200),
+]
+
+
+def _figure_key(value):
+    # Hashable cache key for a chart value; NaN never equals itself
+    value = float(value)
+    return None if math.isnan(value) else round(value, 6)
+
+
+@lru_cache(maxsize=None)
+def gauge_template(min_val, max_val):
+    return {
+        "axis": {"range": [min_val, max_val]},
+        "bar": {"color": "darkblue"},
+        "steps": [
+            {"range": [0, max_val / 3], "color": "lightgray"},
+            {"range": [max_val / 3, 2 * max_val / 3], "color": "gray"},
+        ],
+    }
+
+
+def _gauge_indicator(value, title, min_val, max_val, domain):
+    return go.Indicator(
+        mode="gauge+number",
+        value=value,
+        title={"text": title},
+        domain=domain,
+        gauge=gauge_template(min_val, max_val),
+    )
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def _gauge_chart(value, title, min_val, max_val):
     fig = go.Figure(
-        go.Indicator(
-            mode="gauge+number",
-            value=value,
-            title={"text": title},
-            domain={"x": [0, 1], "y": [0, 1]},
-            gauge={
-                "axis": {"range": [min_val, max_val]},
-                "bar": {"color": "darkblue"},
-                "steps": [
-                    {"range": [0, max_val / 3], "color": "lightgray"},
-                    {"range": [max_val / 3, 2 * max_val / 3], "color": "gray"},
-                ],
-            },
-        )
+        _gauge_indicator(value, title, min_val, max_val, {"x": [0, 1], "y": [0, 1]})
     )
     fig.update_layout(height=200)
     return fig
 
 
-def display_financial_period_results(
-    revenue,
-    operating_profit,
-    ebit,
-    cogs,
-    net_profit,
-    interest_expense,
-    pbit,
-    total_assets,
-    current_assets,
-    liquid_current_assets,
-    cash,
-    average_inventory,
-    total_equity,
-    current_liabilities,
-    cash_equivalents,
-    average_accounts_receivable,
-    average_accounts_payable,
-    total_debt,
-    shareholders_equity,
-    capital_employed,
-    average_assets,
-    average_total_assets,
-    net_sales,
-    net_credit_sales,
-    net_annual_sales,
-    net_credit_purchases,
-    average_working_capital,
-):
-    try:
-        # Calculate all ratios (same calculations as before)
-        profitability_ratios = {
-            "Gross Profit Margin": (
-                ((revenue - cogs) / revenue * 100) if revenue != 0 else 0
-            ),
-            "Operating Profit Margin": (
-                (operating_profit / revenue * 100) if revenue != 0 else 0
-            ),
-            "Net Profit Margin": (net_profit / revenue * 100) if revenue != 0 else 0,
-            "Return on Assets": (
-                (net_profit / average_assets * 100) if average_assets != 0 else 0
-            ),
-            "Return on Capital Employed": (
-                (pbit / capital_employed * 100) if capital_employed != 0 else 0
-            ),
-            "Return on Equity": (
-                (net_profit / shareholders_equity * 100)
-                if shareholders_equity != 0
-                else 0
-            ),
-        }
+def create_gauge_chart(value, title, min_val=0, max_val=100):
+    # Memoized: the returned figure is shared, do not modify it
+    return _gauge_chart(_figure_key(value), title, min_val, max_val)
 
-        liquidity_ratios = {
-            "Current Ratio": (
-                current_assets / current_liabilities if current_liabilities != 0 else 0
-            ),
-            "Quick Ratio": (
-                liquid_current_assets / current_liabilities
-                if current_liabilities != 0
-                else 0
-            ),
-            "Cash Ratio": (
-                (cash + cash_equivalents) / current_liabilities
-                if current_liabilities != 0
-                else 0
-            ),
-        }
 
-        efficiency_ratios = {
-            "Accounts Receivable Turnover": (
-                net_credit_sales / average_accounts_receivable
-                if average_accounts_receivable != 0
-                else 0
-            ),
-            "Accounts Payable Turnover": (
-                net_credit_purchases / average_accounts_payable
-                if average_accounts_payable != 0
-                else 0
-            ),
-            "Assets Turnover": (
-                net_sales / average_total_assets if average_total_assets != 0 else 0
-            ),
-            "Capital Turnover": (
-                net_sales / capital_employed if capital_employed != 0 else 0
-            ),
-            "Inventory Turnover": (
-                cogs / average_inventory if average_inventory != 0 else 0
-            ),
-            "Working Capital Turnover": (
-                net_annual_sales / average_working_capital
-                if average_working_capital != 0
-                else 0
-            ),
-        }
-
-        solvency_ratios = {
-            "Debt Ratio": total_debt / total_assets if total_assets != 0 else 0,
-            "Equity Ratio": total_equity / total_assets if total_assets != 0 else 0,
-            "Debt to Equity": total_debt / total_equity if total_equity != 0 else 0,
-            "Interest Coverage": (
-                ebit / interest_expense if interest_expense != 0 else 0
-            ),
-        }
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def _gauges_chart(values):
+    fig = go.Figure()
+    width = 1 / len(GAUGES)
+    for i, (value, (_, title, _, max_val)) in enumerate(zip(values, GAUGES)):
+        # A small gap between the gauges keeps their labels apart
+        domain = {"x": [i * width + 0.02, (i + 1) * width - 0.02], "y": [0, 1]}
+        fig.add_trace(_gauge_indicator(value, title, 0, max_val, domain))
+    fig.update_layout(height=250, margin={"t": 60, "b": 20})
+    return fig
 
-        # Display Ratios in two columns
-        col1, col2 = st.columns(2)
 
-        with col1:
-            st.subheader("Profitability Ratios")
-            prof_df = pd.DataFrame(
-                list(profitability_ratios.items()), columns=["Ratio", "Value"]
-            )
-            prof_df["Value"] = prof_df["Value"].round(2).astype(str) + "%"
-            st.dataframe(prof_df, use_container_width=True, hide_index=True)
+def create_gauges_chart(ratios):
+    # All GAUGES in one figure (one chart payload instead of three)
+    return _gauges_chart(
+        tuple(_figure_key(ratios[name] * scale) for name, _, scale, _ in GAUGES)
+    )
 
-            st.subheader("Solvency Ratios")
-            solv_df = pd.DataFrame(
-                list(solvency_ratios.items()), columns=["Ratio", "Value"]
-            )
-            solv_df["Value"] = solv_df["Value"].round(2)
-            st.dataframe(solv_df, use_container_width=True, hide_index=True)
 
-        with col2:
-            st.subheader("Efficiency Ratios")
-            eff_df = pd.DataFrame(
-                list(efficiency_ratios.items()), columns=["Ratio", "Value"]
-            )
-            eff_df["Value"] = eff_df["Value"].round(2)
-            st.dataframe(eff_df, use_container_width=True, hide_index=True)
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def _profitability_bar(values):
+    return px.bar(
+        pd.DataFrame(values, columns=["Ratio", "Value"]),
+        x="Ratio",
+        y="Value",
+        title="Profitability Ratios Comparison",
+    )
 
-            st.subheader("Liquidity Ratios")
-            liq_df = pd.DataFrame(
-                list(liquidity_ratios.items()), columns=["Ratio", "Value"]
-            )
-            liq_df["Value"] = liq_df["Value"].round(2)
-            st.dataframe(liq_df, use_container_width=True, hide_index=True)
-
-        # Visualizations
-        st.markdown("---")
-        st.header("Ratio Visualizations")
-
-        # Gauge charts
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.plotly_chart(
-                create_gauge_chart(
-                    profitability_ratios["Net Profit Margin"], "Net Profit Margin (%)"
-                ),
-                use_container_width=True,
-            )
 
-        with col2:
-            st.plotly_chart(
-                create_gauge_chart(
-                    liquidity_ratios["Current Ratio"] * 100,
-                    "Current Ratio",
-                    max_val=300,
-                ),
-                use_container_width=True,
-            )
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def _efficiency_polar(values):
+    return px.line_polar(
+        pd.DataFrame(values, columns=["Ratio", "Value"]),
+        r="Value",
+        theta="Ratio",
+        line_close=True,
+        title="Efficiency Ratios Overview",
+    )
+
+
+def _group_values(ratios, group):
+    df = ratio_group_frame(ratios, group)
+    return tuple(zip(df["Ratio"], map(_figure_key, df["Value"])))
+
+
+def ratio_group_frame(ratios, group):
+    df = pd.DataFrame(
+        [(name, ratios[name]) for name in RATIO_GROUPS[group]],
+        columns=["Ratio", "Value"],
+    )
+    df["Value"] = df["Value"].astype("float64").round(2)
+    return df
+
 
-        with col3:
-            st.plotly_chart(
-                create_gauge_chart(
-                    solvency_ratios["Debt to Equity"] * 100,
-                    "Debt to Equity Ratio",
-                    max_val=200,
-                ),
-                use_container_width=True,
+def percent_frame(df):
+    return df.assign(Value=df["Value"].astype(str) + "%")
+
+
+# Everything rendered for a period, with the ratios each piece is built from.
+# Only the pieces whose ratios changed since the previous render are rebuilt.
+RESULT_ARTIFACTS = {
+    "profitability_table": (
+        RATIO_GROUPS["Profitability Ratios"],
+        lambda r: percent_frame(ratio_group_frame(r, "Profitability Ratios")),
+    ),
+    "solvency_table": (
+        RATIO_GROUPS["Solvency Ratios"],
+        lambda r: ratio_group_frame(r, "Solvency Ratios"),
+    ),
+    "efficiency_table": (
+        RATIO_GROUPS["Efficiency Ratios"],
+        lambda r: ratio_group_frame(r, "Efficiency Ratios"),
+    ),
+    "liquidity_table": (
+        RATIO_GROUPS["Liquidity Ratios"],
+        lambda r: ratio_group_frame(r, "Liquidity Ratios"),
+    ),
+    "gauges": (
+        [name for name, _, _, _ in GAUGES],
+        create_gauges_chart,
+    ),
+    "profitability_bar": (
+        RATIO_GROUPS["Profitability Ratios"],
+        lambda r: _profitability_bar(_group_values(r, "Profitability Ratios")),
+    ),
+    "efficiency_polar": (
+        RATIO_GROUPS["Efficiency Ratios"],
+        lambda r: _efficiency_polar(_group_values(r, "Efficiency Ratios")),
+    ),
+}
+
+
+def build_result_artifacts(metrics, state_key="ratio_results", ratios=None):
+    # ratios: precomputed values (e.g. stored on the document), if available
+    state = st.session_state.get(state_key)
+    if state is None:
+        if ratios is None:
+            ratios = compute_ratios(metrics).iloc[0]
+        artifacts = {}
+        stale = list(RESULT_ARTIFACTS)
+    else:
+        if ratios is None:
+            ratios, changed = update_ratios(state["metrics"], state["ratios"], metrics)
+        else:
+            changed = changed_ratios(state["ratios"], ratios)
+        artifacts = state["artifacts"]
+        stale = [
+            name
+            for name, (inputs, _) in RESULT_ARTIFACTS.items()
+            if name not in artifacts or changed.intersection(inputs)
+        ]
+
+    for name in stale:
+        artifacts[name] = RESULT_ARTIFACTS[name][1](ratios)
+
+    st.session_state[state_key] = {
+        "metrics": dict(metrics),
+        "ratios": ratios,
+        "artifacts": artifacts,
+    }
+    return artifacts
+
+
+def display_financial_period_results(state_key="ratio_results", duration_type=None, **metrics):
+    # duration_type: also rank the ratios against stored periods of that type
+    try:
+        artifacts = build_result_artifacts(metrics, state_key)
+        display_ratio_results(artifacts)
+        if duration_type:
+            display_peer_percentiles(st.session_state[state_key]["ratios"], duration_type)
+    except Exception as e:
+        st.error(f"An error occurred while calculating ratios: {str(e)}")
+        st.error("Please check your input values and try again.")
+
+
+def display_period_document(entry, state_key="ratio_results"):
+    try:
+        artifacts = build_result_artifacts(
+            entry["data"], state_key, ratios=stored_ratios(entry)
+        )
+        display_ratio_results(artifacts)
+        if entry.get("complete") is False:
+            # A partial rollup would be ranked against complete periods
+            st.markdown("---")
+            st.header("Peer Comparison")
+            st.caption(
+                f"Derived from {entry.get('source_months', 'some')} months only; "
+                "not ranked against peers until the period is complete."
             )
+            return
+        display_peer_percentiles(
+            st.session_state[state_key]["ratios"], entry["duration_type"]
+        )
+    except Exception as e:
+        st.error(f"An error occurred while calculating ratios: {str(e)}")
+        st.error("Please check your input values and try again.")
 
-        # Additional charts
-        st.plotly_chart(
-            px.bar(
-                prof_df, x="Ratio", y="Value", title="Profitability Ratios Comparison"
-            ),
-            use_container_width=True,
+
+def display_ratio_results(artifacts):
+    # Display Ratios in two columns
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("Profitability Ratios")
+        st.dataframe(
+            artifacts["profitability_table"], use_container_width=True, hide_index=True
+        )
+
+        st.subheader("Solvency Ratios")
+        st.dataframe(
+            artifacts["solvency_table"], use_container_width=True, hide_index=True
+        )
+
+    with col2:
+        st.subheader("Efficiency Ratios")
+        st.dataframe(
+            artifacts["efficiency_table"], use_container_width=True, hide_index=True
         )
 
-        st.plotly_chart(
-            px.line_polar(
-                eff_df,
-                r="Value",
-                theta="Ratio",
-                line_close=True,
-                title="Efficiency Ratios Overview",
+        st.subheader("Liquidity Ratios")
+        st.dataframe(
+            artifacts["liquidity_table"], use_container_width=True, hide_index=True
+        )
+
+    # Visualizations
+    st.markdown("---")
+    st.header("Ratio Visualizations")
+
+    # Gauge charts
+    st.plotly_chart(artifacts["gauges"], use_container_width=True)
+
+    # Additional charts
+    st.plotly_chart(artifacts["profitability_bar"], use_container_width=True)
+    st.plotly_chart(artifacts["efficiency_polar"], use_container_width=True)
+
+
+def display_peer_percentiles(ratios, duration_type):
+    # Percentiles come from the persisted sketches (utils/peers.py), never
+    # from a scan of everyone's periods
+    st.markdown("---")
+    st.header("Peer Comparison")
+    try:
+        peers = peer_percentiles(ratios, duration_type)
+    except PyMongoError:
+        st.caption("Peer data is unavailable right now.")
+        return
+    if not peers["Peers"].any():
+        st.caption(f"No peer data for {duration_type} periods yet.")
+        return
+
+    st.caption(
+        f"Percentile of each ratio among all stored periods of type {duration_type}"
+    )
+    st.dataframe(
+        peers,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Value": st.column_config.NumberColumn("Value", format="%.2f"),
+            "Percentile": st.column_config.ProgressColumn(
+                "Percentile", min_value=0, max_value=100, format="%.0f"
             ),
+        },
+    )
+
+
+def display_ratio_history(data_list):
+    history = compute_history_ratios(data_list)
+    if history.empty:
+        return
+    with st.expander("Ratio History", expanded=False):
+        st.dataframe(
+            history.round(2),
+            hide_index=True,
             use_container_width=True,
         )
-
-    except Exception as e:
-        st.error(f"An error occurred while calculating ratios: {str(e)}")
-        st.error("Please check your input values and try again.")
@@ -0,0 +1,127 @@
+# utils/rollups.py
+import pandas as pd
+from pymongo.errors import DuplicateKeyError
+from utils.db import get_financial_data
+from utils.peers import SKETCH_PROJECTION, update_peer_sketches
+from utils.periods import (
+    build_period_document,
+    bump_data_version,
+    find_periods_in,
+    fiscal_year_label,
+    quarter_label,
+)
+from utils.ratios import METRIC_KEYS
+
+
+# How each metric combines from months into a quarter or year:
+#   flow    - summed over the months (income statement items)
+#   stock   - value at the end of the period (balance sheet positions)
+#   average - mean of the monthly values (metrics that already are averages)
+METRIC_KINDS = {
+    # Income Statement Metrics
+    "revenue": "flow",
+    "operating_profit": "flow",
+    "ebit": "flow",
+    "cogs": "flow",
+    "net_profit": "flow",
+    "interest_expense": "flow",
+    "pbit": "flow",
+    # Balance Sheet Metrics
+    "total_assets": "stock",
+    "current_assets": "stock",
+    "liquid_current_assets": "stock",
+    "cash": "stock",
+    "average_inventory": "average",
+    "total_equity": "stock",
+    "current_liabilities": "stock",
+    "cash_equivalents": "stock",
+    "average_accounts_receivable": "average",
+    "average_accounts_payable": "average",
+    "total_debt": "stock",
+    "shareholders_equity": "stock",
+    "capital_employed": "stock",
+    "average_assets": "average",
+    "average_total_assets": "average",
+    # Sales Metrics
+    "net_sales": "flow",
+    "net_credit_sales": "flow",
+    # Already an annual figure in every monthly entry
+    "net_annual_sales": "stock",
+    "net_credit_purchases": "flow",
+    "average_working_capital": "average",
+}
+
+FLOW_METRICS = [key for key in METRIC_KEYS if METRIC_KINDS[key] == "flow"]
+STOCK_METRICS = [key for key in METRIC_KEYS if METRIC_KINDS[key] == "stock"]
+AVERAGE_METRICS = [key for key in METRIC_KEYS if METRIC_KINDS[key] == "average"]
+
+MONTHS_IN = {"Quarterly": 3, "Annually": 12}
+
+
+def rollup_metrics(months):
+    # months: DataFrame of monthly metrics sorted by start_date
+    metrics = pd.concat(
+        [
+            months[FLOW_METRICS].sum(),
+            months[STOCK_METRICS].iloc[-1],
+            months[AVERAGE_METRICS].mean(),
+        ]
+    )
+    return {key: float(metrics[key]) for key in METRIC_KEYS}
+
+
+def parent_periods(month_start):
+    # Derived periods a month contributes to: [(duration_type, label)]
+    return [
+        ("Quarterly", quarter_label(month_start)),
+        ("Annually", fiscal_year_label(month_start)),
+    ]
+
+
+def update_rollup(username, duration_type, duration):
+    # Rebuilds one derived quarter/year from the months stored in its range;
+    # only those months are read (username, duration_type, period_index index).
+    # A period entered by hand is never overwritten.
+    collection = get_financial_data()
+    months = find_periods_in(
+        username, duration, duration_type, "Monthly", projection={"data": 1}
+    )
+    key = {"username": username, "duration_type": duration_type, "duration": duration}
+    if not months:
+        previous = collection.find_one_and_delete({**key, "derived": True}, SKETCH_PROJECTION)
+        update_peer_sketches([(previous, None)])
+        return False
+
+    frame = pd.DataFrame([entry["data"] for entry in months], columns=METRIC_KEYS)
+    document = build_period_document(
+        username, duration, duration_type, rollup_metrics(frame.astype("float64"))
+    )
+    document["derived"] = True
+    document["source_months"] = len(months)
+    document["complete"] = len(months) == MONTHS_IN[duration_type]
+
+    try:
+        previous = collection.find_one_and_replace(
+            {**key, "derived": True}, document, SKETCH_PROJECTION, upsert=True
+        )
+    except DuplicateKeyError:
+        # A manually entered period already holds this key
+        return False
+    update_peer_sketches([(previous, document)])
+    return True
+
+
+def update_rollups(username, month_starts):
+    # Refreshes every quarter and year touched by the given months, once each
+    periods = {
+        period for month_start in month_starts for period in parent_periods(month_start)
+    }
+    for duration_type, duration in sorted(periods):
+        update_rollup(username, duration_type, duration)
+    if periods:
+        bump_data_version(username)
+    return len(periods)
+
+
+def month_start_of(document):
+    return document["start_date"].date()
@@ -0,0 +1,153 @@
+# utils/sessions.py
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+import streamlit as st
+from pymongo import ReturnDocument
+from utils.db import get_db
+
+
+# Lifetime of a session token
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(8 * 3600)))
+
+# How long a replica may keep using its copy of the revocation list
+REVOCATION_REFRESH_SECONDS = int(os.getenv("SESSION_REVOCATION_REFRESH_SECONDS", "30"))
+
+# Cookie that carries the token, so a reload keeps the login. Streamlit can
+# read cookies (st.context.cookies) but not set them, so the browser sets it
+# from a script (utils/auth.py). That keeps the token out of URLs, browser
+# history, proxy logs and shared links; the tradeoff is that a script-set
+# cookie cannot be HttpOnly, so script injected into the page could read it.
+SESSION_COOKIE = "session"
+
+# Secure cookies are only sent over HTTPS (and to http://localhost); set to
+# "false" for a deployment served over plain HTTP
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "true").lower() == "true"
+
+# URL parameter older versions carried the token in; removed on sight
+LEGACY_SESSION_PARAM = "session"
+
+SETTINGS_COLLECTION = "settings"
+REVOCATIONS_COLLECTION = "session_revocations"
+
+
+@st.cache_resource
+def get_secret():
+    # SESSION_SECRET when set; otherwise a random key generated once and
+    # stored in the database, so every replica signs with the same key
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    setting = get_db()[SETTINGS_COLLECTION].find_one_and_update(
+        {"_id": "session_secret"},
+        {"$setOnInsert": {"value": secrets.token_urlsafe(32)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return setting["value"].encode("utf-8")
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return _encode(hmac.new(get_secret(), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(profile, ttl=SESSION_TTL_SECONDS):
+    # profile: {"username", "name", "role"}; returns "<payload>.<signature>".
+    # jti identifies the token so a logout can revoke just this one.
+    now = time.time()
+    claims = {**profile, "iat": now, "exp": now + ttl, "jti": secrets.token_urlsafe(16)}
+    payload = _encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def _claims(token):
+    # The claims of a correctly signed, unexpired token; None otherwise
+    try:
+        payload, signature = token.split(".")
+        # bytes: compare_digest rejects str arguments with non-ASCII characters
+        if not hmac.compare_digest(signature.encode("utf-8"), _sign(payload).encode("ascii")):
+            return None
+        claims = json.loads(_decode(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+
+def verify_token(token):
+    # The profile in a valid, unexpired, unrevoked token; None otherwise.
+    # Only the (cached) revocation list is read, never the user document.
+    claims = _claims(token)
+    if claims is None:
+        return None
+    revoked_users, revoked_tokens = revocations()
+    revoked_at = revoked_users.get(claims.get("username"))
+    if revoked_at is not None and claims.get("iat", 0) <= revoked_at:
+        return None
+    if claims.get("jti") in revoked_tokens:
+        return None
+    return {key: claims.get(key) for key in ("username", "name", "role")}
+
+
+@st.cache_data(ttl=REVOCATION_REFRESH_SECONDS, show_spinner=False)
+def revocations():
+    # ({username: unix time before which their tokens are invalid}, {jti of
+    # a logged out token}); entries expire (TTL index) once every token they
+    # cover has expired anyway
+    revoked_users, revoked_tokens = {}, set()
+    for entry in get_db()[REVOCATIONS_COLLECTION].find({}, {"revoked_at": 1, "jti": 1}):
+        if "jti" in entry:
+            revoked_tokens.add(entry["jti"])
+        else:
+            revoked_users[entry["_id"]] = entry["revoked_at"]
+    return revoked_users, revoked_tokens
+
+
+def revoke_sessions(username):
+    # Invalidates every token issued to the user so far; other replicas
+    # pick this up within REVOCATION_REFRESH_SECONDS
+    now = datetime.now(timezone.utc)
+    get_db()[REVOCATIONS_COLLECTION].update_one(
+        {"_id": username},
+        {
+            "$set": {
+                "revoked_at": now.timestamp(),
+                "expires": now + timedelta(seconds=SESSION_TTL_SECONDS),
+            }
+        },
+        upsert=True,
+    )
+    revocations.clear()
+
+
+def revoke_token(token):
+    # Logout: invalidates this one token (e.g. a copied URL), kept until it
+    # would have expired anyway
+    claims = _claims(token)
+    if claims is None or "jti" not in claims:
+        return
+    get_db()[REVOCATIONS_COLLECTION].update_one(
+        {"_id": f"jti:{claims['jti']}"},
+        {
+            "$set": {
+                "jti": claims["jti"],
+                "expires": datetime.fromtimestamp(claims["exp"], timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+    revocations.clear()
@@ -0,0 +1,171 @@
+# utils/throttle.py
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+import streamlit as st
+from pymongo import ReturnDocument
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils.db import get_db
+
+
+# Token buckets: each login attempt takes one token; a bucket holds at most
+# CAPACITY tokens and regains PER_MINUTE tokens a minute
+USERNAME_CAPACITY = int(os.getenv("LOGIN_USERNAME_CAPACITY", "5"))
+USERNAME_PER_MINUTE = float(os.getenv("LOGIN_USERNAME_PER_MINUTE", "5"))
+CLIENT_CAPACITY = int(os.getenv("LOGIN_CLIENT_CAPACITY", "20"))
+CLIENT_PER_MINUTE = float(os.getenv("LOGIN_CLIENT_PER_MINUTE", "20"))
+
+# "memory" (per process) or "mongo" (shared by every replica)
+THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "memory")
+
+# Buckets kept by the memory backend (least recently used dropped first)
+MEMORY_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+THROTTLE_COLLECTION = "login_throttle"
+
+# Reverse proxies in front of the app that append to X-Forwarded-For. 0 (the
+# default) ignores forwarding headers, which any client can set itself.
+TRUSTED_PROXY_HOPS = int(os.getenv("LOGIN_TRUSTED_PROXY_HOPS", "0"))
+
+
+class MemoryBackend:
+    def __init__(self, max_keys=MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, per_second):
+        # Returns (allowed, seconds until a token is available)
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / per_second
+
+
+class MongoBackend:
+    # One document per bucket, refilled and decremented atomically by a
+    # pipeline update so concurrent replicas never double-spend a token.
+    # Idle buckets expire through the TTL index created by init_db.py.
+    def __init__(self, collection):
+        self.collection = collection
+
+    def take(self, key, capacity, per_second):
+        now = datetime.now(timezone.utc)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 1000]}
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {
+                    "$set": {
+                        "tokens": {
+                            "$min": [
+                                capacity,
+                                {
+                                    "$add": [
+                                        {"$ifNull": ["$tokens", capacity]},
+                                        {"$multiply": [elapsed, per_second]},
+                                    ]
+                                },
+                            ]
+                        }
+                    }
+                },
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {
+                    "$set": {
+                        "tokens": {
+                            "$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]
+                        },
+                        "updated": now,
+                    }
+                },
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return True, 0
+        return False, (1 - bucket["tokens"]) / per_second
+
+
+@st.cache_resource
+def get_backend():
+    if THROTTLE_BACKEND == "mongo":
+        return MongoBackend(get_db()[THROTTLE_COLLECTION])
+    if THROTTLE_BACKEND == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Invalid login throttle backend: {THROTTLE_BACKEND}")
+
+
+# Process-wide counters for monitoring (see throttle_stats)
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def throttle_stats():
+    with _counters_lock:
+        return {
+            "attempts": _counters["attempts"],
+            "allowed": _counters["allowed"],
+            "rejected_client": _counters["rejected_client"],
+            "rejected_username": _counters["rejected_username"],
+        }
+
+
+def client_id():
+    # The address the outermost trusted proxy saw: each of the
+    # TRUSTED_PROXY_HOPS proxies appends its peer to X-Forwarded-For, so the
+    # client is that many entries from the right; anything further left was
+    # supplied by the client. Without trusted proxies (or a usable header),
+    # fall back to the browser session (the per-username bucket still applies).
+    if TRUSTED_PROXY_HOPS > 0:
+        headers = st.context.headers
+        forwarded = [
+            address.strip()
+            for address in headers.get("X-Forwarded-For", "").split(",")
+            if address.strip()
+        ]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+        # A single proxy may report its peer in X-Real-Ip instead
+        if TRUSTED_PROXY_HOPS == 1 and headers.get("X-Real-Ip"):
+            return headers["X-Real-Ip"].strip()
+    ctx = get_script_run_ctx()
+    return f"session:{ctx.session_id}" if ctx else "local"
+
+
+def check_login_attempt(username, client=None):
+    # Takes a token from the client's and the username's buckets. Returns
+    # (allowed, retry_after_seconds); call before touching the database.
+    backend = get_backend()
+    _count("attempts")
+    allowed, retry_after = backend.take(
+        f"client:{client or client_id()}", CLIENT_CAPACITY, CLIENT_PER_MINUTE / 60
+    )
+    if not allowed:
+        _count("rejected_client")
+        return False, retry_after
+
+    allowed, retry_after = backend.take(
+        f"user:{username.strip().lower()}", USERNAME_CAPACITY, USERNAME_PER_MINUTE / 60
+    )
+    if not allowed:
+        _count("rejected_username")
+        return False, retry_after
+
+    _count("allowed")
+    return True, 0
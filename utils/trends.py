@@ -0,0 +1,99 @@
+# utils/trends.py
+import streamlit as st
+import numpy as np
+import pandas as pd
+from utils.fiscal_calendar import period_table
+from utils.periods import CACHE_MAX_ENTRIES, find_periods
+from utils.ratios import METRIC_KEYS, METRIC_LABELS, RATIO_NAMES, compute_history_ratios
+
+
+PERIODS_PER_YEAR = {"Monthly": 12, "Quarterly": 4, "Annually": 1}
+
+TREND_MEASURES = {
+    "value": "Value",
+    "growth": "Period-over-period growth (%)",
+    "yoy": "Year-over-year growth (%)",
+    "rolling": "Rolling average",
+}
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_trend_frame(username, data_version, duration_type):
+    # One row per period of the calendar between the user's first and last
+    # stored period (gaps stay NaN so shifts line up), with the 27 metrics and
+    # every ratio as columns, indexed by period start.
+    # data_version keys the cache like the history pages (utils/periods.py).
+    # Partial derived quarters/years would read as a drop in every growth
+    # measure; they are left out (NaN, or past the end of the frame).
+    entries = find_periods(username, duration_type, complete_only=True)
+    columns = [METRIC_LABELS[key] for key in METRIC_KEYS] + RATIO_NAMES
+    if not entries:
+        return pd.DataFrame(columns=["Period"] + columns)
+
+    metrics = pd.DataFrame.from_records(
+        [entry["data"] for entry in entries], columns=METRIC_KEYS
+    ).astype("float64")
+    ratios = compute_history_ratios(entries)[RATIO_NAMES].astype("float64")
+    frame = pd.concat([metrics.rename(columns=METRIC_LABELS), ratios], axis=1)
+    frame.index = pd.to_datetime([entry["start_date"] for entry in entries])
+    frame = frame[~frame.index.duplicated(keep="last")]
+
+    calendar = period_table(duration_type)
+    calendar = calendar[
+        (calendar["start"] >= frame.index.min()) & (calendar["start"] <= frame.index.max())
+    ]
+    frame = frame.reindex(pd.DatetimeIndex(calendar["start"]))
+    frame.insert(0, "Period", calendar["label"].to_numpy())
+    frame.index.name = "Start"
+    return frame
+
+
+def _growth(values, periods):
+    # Percentage change against `periods` rows earlier; NaN when the base is
+    # zero or missing
+    base = np.roll(values, periods, axis=0)
+    base[:periods] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = (values - base) / np.abs(base) * 100
+    growth[~np.isfinite(growth)] = np.nan
+    return growth
+
+
+def compute_trends(frame, duration_type, window=3):
+    # All trend measures for every metric and ratio column in one pass over
+    # the sorted history: {measure: DataFrame}
+    data = frame.drop(columns="Period")
+    values = data.to_numpy(dtype="float64")
+    per_year = PERIODS_PER_YEAR[duration_type]
+
+    trends = {
+        "value": data,
+        "growth": pd.DataFrame(_growth(values, 1), index=data.index, columns=data.columns),
+        "yoy": pd.DataFrame(_growth(values, per_year), index=data.index, columns=data.columns),
+        "rolling": data.rolling(window, min_periods=1).mean(),
+    }
+    for trend in trends.values():
+        trend.insert(0, "Period", frame["Period"])
+    return trends
+
+
+def compute_cagr(frame):
+    # Compound annual growth between each column's first and last available
+    # value; NaN where either end is not positive
+    data = frame.drop(columns="Period")
+    first = data.apply(lambda column: column.first_valid_index())
+    last = data.apply(lambda column: column.last_valid_index())
+
+    values = data.to_numpy(dtype="float64")
+    index = data.index
+    first_pos = index.get_indexer(pd.DatetimeIndex(first.fillna(index[0])))
+    last_pos = index.get_indexer(pd.DatetimeIndex(last.fillna(index[0])))
+    columns = np.arange(values.shape[1])
+    start = values[first_pos, columns]
+    end = values[last_pos, columns]
+    years = (index[last_pos] - index[first_pos]).days.to_numpy() / 365.25
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cagr = (np.power(end / start, 1 / years) - 1) * 100
+    valid = (start > 0) & (end > 0) & (years > 0)
+    return pd.Series(np.where(valid, cagr, np.nan), index=data.columns, name="CAGR (%)")
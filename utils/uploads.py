@@ -0,0 +1,10 @@
+# utils/uploads.py
+import re
+
+
+# Helpers shared by the CSV/Excel uploads (utils/ingest.py, utils/users.py)
+
+
+def normalize_header(name):
+    # " Net Profit (₹)" -> "net_profit"
+    return re.sub(r"\W+", "_", str(name).strip().lower()).strip("_")
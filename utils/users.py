@@ -0,0 +1,163 @@
+# utils/users.py
+import os
+import re
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+from utils.db import get_users
+from utils.uploads import normalize_header
+from utils.passwords import hash_passwords
+
+
+# Fields shown in the admin user table (never the password hash)
+USER_PROJECTION = {"_id": 0, "username": 1, "name": 1, "email": 1, "role": 1}
+
+# Sortable columns -> index-backed sort keys (see init_db.INDEXES); username
+# is unique, so it breaks ties and keeps pages stable
+USER_SORTS = {
+    "Username": [("username", ASCENDING)],
+    "Email": [("email", ASCENDING), ("username", ASCENDING)],
+    "Role": [("role", ASCENDING), ("username", ASCENDING)],
+}
+
+USER_PAGE_SIZE = int(os.getenv("USER_PAGE_SIZE", "25"))
+
+# Matches offered by the search-as-you-type pickers
+SEARCH_LIMIT = int(os.getenv("USER_SEARCH_LIMIT", "20"))
+
+
+def user_query(prefix=""):
+    # Case-sensitive anchored prefix regexes, which MongoDB answers with a
+    # bounded scan of the username and (email, username) indexes
+    prefix = prefix.strip()
+    if not prefix:
+        return {}
+    pattern = {"$regex": f"^{re.escape(prefix)}"}
+    return {"$or": [{"username": pattern}, {"email": pattern}]}
+
+
+def _sort(sort, descending):
+    direction = DESCENDING if descending else ASCENDING
+    return [(field, direction) for field, _ in USER_SORTS[sort]]
+
+
+def fetch_user_page(prefix="", sort="Username", descending=False, page=0, page_size=USER_PAGE_SIZE):
+    # One page of users plus the number of matches, both served by indexes
+    query = user_query(prefix)
+    total = get_users().count_documents(query)
+    users = list(
+        get_users()
+        .find(query, USER_PROJECTION)
+        .sort(_sort(sort, descending))
+        .skip(page * page_size)
+        .limit(page_size)
+    )
+    return users, total
+
+
+def search_usernames(prefix, limit=SEARCH_LIMIT):
+    # Usernames for a picker; the first matches in username order
+    users = (
+        get_users()
+        .find(user_query(prefix), {"_id": 0, "username": 1})
+        .sort("username", ASCENDING)
+        .limit(limit)
+    )
+    return [user["username"] for user in users]
+
+
+USER_ROLES = ("user", "admin")
+
+# Bulk-create CSV columns; role is optional and defaults to "user"
+USER_COLUMNS = ["username", "name", "email", "password", "role"]
+
+MIN_PASSWORD_LENGTH = 6
+
+
+def read_user_csv(uploaded_file):
+    frame = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+    frame.columns = [normalize_header(column) for column in frame.columns]
+    missing = [c for c in USER_COLUMNS if c != "role" and c not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    if "role" not in frame.columns:
+        frame["role"] = ""
+    frame = frame[USER_COLUMNS].apply(lambda column: column.str.strip())
+    frame["role"] = frame["role"].str.lower().replace("", "user")
+    # 1-based data rows as seen in the file
+    return frame.set_axis(pd.RangeIndex(1, len(frame) + 1))
+
+
+def validate_users(frame):
+    # {row: error} for rows that cannot be created: missing fields, bad
+    # roles, short passwords, repeats within the file and accounts that
+    # already exist (one $in query for the whole file)
+    errors = {}
+    empty = frame[["username", "name", "email", "password"]] == ""
+    for row in frame.index[empty.any(axis=1).to_numpy()]:
+        errors[row] = "Missing " + ", ".join(empty.columns[empty.loc[row]])
+    for row in frame.index[~frame["role"].isin(USER_ROLES).to_numpy()]:
+        errors.setdefault(row, f"Unknown role '{frame.at[row, 'role']}'")
+    for row in frame.index[(frame["password"].str.len() < MIN_PASSWORD_LENGTH).to_numpy()]:
+        errors.setdefault(row, f"Password must be at least {MIN_PASSWORD_LENGTH} characters")
+    for field in ("username", "email"):
+        repeated = frame[field].duplicated(keep="first") & (frame[field] != "")
+        for row in frame.index[repeated.to_numpy()]:
+            errors.setdefault(row, f"Duplicate {field} in file")
+
+    existing = get_users().find(
+        {
+            "$or": [
+                {"username": {"$in": frame["username"].tolist()}},
+                {"email": {"$in": frame["email"].tolist()}},
+            ]
+        },
+        {"_id": 0, "username": 1, "email": 1},
+    )
+    taken_usernames, taken_emails = set(), set()
+    for user in existing:
+        taken_usernames.add(user["username"])
+        taken_emails.add(user.get("email"))
+    for row in frame.index[frame["username"].isin(taken_usernames).to_numpy()]:
+        errors.setdefault(row, "Username already exists")
+    for row in frame.index[frame["email"].isin(taken_emails).to_numpy()]:
+        errors.setdefault(row, "Email already registered")
+    return errors
+
+
+def create_users(uploaded_file, progress=None):
+    # Bulk create from CSV; returns a report DataFrame (Row, Username,
+    # Status, Message). Passwords are hashed across the process pool and the
+    # documents written with one unordered insert_many, so a duplicate that
+    # appears meanwhile only fails its own row.
+    frame = read_user_csv(uploaded_file)
+    errors = validate_users(frame)
+    valid = frame.drop(index=list(errors))
+
+    hashed = hash_passwords(valid["password"].tolist(), progress=progress)
+    documents = [
+        {"username": username, "name": name, "email": email, "password": password, "role": role}
+        for username, name, email, password, role in zip(
+            valid["username"], valid["name"], valid["email"], hashed, valid["role"]
+        )
+    ]
+    rows = valid.index.tolist()
+    if documents:
+        try:
+            get_users().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                message = error["errmsg"]
+                if error.get("code") == 11000:
+                    message = "Username or email already registered"
+                errors[rows[error["index"]]] = message
+
+    report = pd.DataFrame(
+        {
+            "Row": frame.index,
+            "Username": frame["username"],
+            "Status": ["Failed" if row in errors else "Created" for row in frame.index],
+            "Message": [errors.get(row, "") for row in frame.index],
+        }
+    )
+    return report